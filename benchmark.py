@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for filter.py.
+
+Times every filter function on its own and the full main() pipeline at
+several corpus sizes, reporting lines per second and peak memory. Runs
+offline on synthetic corpora from generate_corpus.py, whose word
+distribution comes from the accepted sentences bundled in output_preview/
+and single_sentences/ and whose defect mix gives every fast filter
+something to reject, except max_word_count_filter: with the default
+thresholds any sentence it would reject is too long for
+reading_time_filter, which runs first.
+
+Results can be stored as a baseline and compared against later runs:
+
+    python benchmark.py --save_baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import filter as cv_filter
+import generate_corpus
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FOLDERS = ["output_preview", "single_sentences"]
+
+################################################################
+# Corpus
+################################################################
+
+def load_bundled_sentences():
+    """Return the sentences (first column) of every bundled output TSV file."""
+    sentences = []
+    for folder in SAMPLE_FOLDERS:
+        for path in sorted(glob.glob(os.path.join(REPO_DIR, folder, "*.tsv"))):
+            with open(path, 'r', encoding='utf-8') as infile:
+                for line in infile:
+                    sentence = line.split('\t')[0].strip()
+                    if sentence:
+                        sentences.append(sentence)
+    return sentences
+
+def write_corpus(path: str, model, size: str, seed: int = 0) -> int:
+    """
+    Write a synthetic corpus of size lines, or of size bytes if it has a
+    unit suffix (e.g. '10MB'). Returns the number of lines written.
+    """
+    rates = {name: default for name, default, _ in generate_corpus.DEFECTS}
+    if size.isdigit():
+        return generate_corpus.write_corpus(path, model, rates, num_lines=int(size), seed=seed)
+    return generate_corpus.write_corpus(path, model, rates, num_bytes=generate_corpus.parse_size(size), seed=seed)
+
+def read_corpus(path: str):
+    return [sentence for _, sentence in cv_filter.read_sentences(path)]
+
+################################################################
+# Filter benchmarks
+################################################################
+
+def time_calls(func, sentences, repeat: int):
+    """Best wall time over repeat runs of func over all sentences."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for sentence in sentences:
+            func(sentence)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def time_batched(batch_filter, sentences, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in batch_filter(sentences):
+            pass
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def filter_result(seconds: float, num_lines: int):
+    return {
+        "seconds": seconds,
+        "lines_per_second": num_lines / seconds if seconds else None,
+        "ns_per_line": seconds / num_lines * 1e9 if num_lines else None,
+    }
+
+def benchmark_filters(sentences, repeat: int, spacy_sentences: int, skip_spacy: bool):
+    results = {}
+    for filter_func, filter_name in cv_filter.FAST_FILTERS:
+        results[filter_name] = filter_result(time_calls(filter_func, sentences, repeat), len(sentences))
+
+    chain = cv_filter.create_fast_filter_chain(cv_filter.FAST_FILTERS)
+    results["fast_filter_chain"] = filter_result(time_calls(chain, sentences, repeat), len(sentences))
+    results["fused_fast_filters"] = filter_result(time_calls(cv_filter.fused_fast_filters, sentences, repeat), len(sentences))
+    try:
+        import pyarrow as pa
+        columnar = cv_filter.create_columnar_fast_filters()
+    except ImportError:
+        print("pyarrow or numpy not installed; skipping the columnar engine.")
+    else:
+        blocks = [pa.array(sentences[i:i + 65536], type=pa.string()) for i in range(0, len(sentences), 65536)]
+        results["columnar_fast_filters"] = filter_result(time_calls(columnar, blocks, repeat), len(sentences))
+
+    if skip_spacy:
+        return results
+    try:
+        nlp = cv_filter.load_spacy_model()
+        minimal_nlp = cv_filter.load_spacy_model(minimal=True)
+    except OSError:
+        print(f"Model '{cv_filter.SPACY_MODEL}' not installed; skipping spaCy benchmarks.")
+        return results
+
+    # spaCy is orders of magnitude slower, so it runs on a subset of the
+    # sentences that survive the fast filters.
+    survivors = [s for s in sentences if cv_filter.fused_fast_filters(s) is None][:spacy_sentences]
+    if not survivors:
+        return results
+    results["proper_noun_filter"] = filter_result(
+        time_calls(cv_filter.create_proper_noun_filter(nlp), survivors, 1), len(survivors))
+    results["proper_noun_filter_batched"] = filter_result(
+        time_batched(cv_filter.create_batched_proper_noun_filter(nlp), survivors, 1), len(survivors))
+    results["proper_noun_filter_batched_minimal"] = filter_result(
+        time_batched(cv_filter.create_batched_proper_noun_filter(minimal_nlp), survivors, 1), len(survivors))
+    return results
+
+################################################################
+# Pipeline benchmarks
+################################################################
+
+def _run_main(argv, connection):
+    # Runs in a child process so that peak RSS belongs to this run alone
+    devnull = open(os.devnull, 'w')
+    sys.stdout = sys.stderr = devnull
+    sys.argv = ["filter.py"] + argv
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    cv_filter.main()
+    connection.send({
+        "seconds": time.perf_counter() - start,
+        "cpu_seconds": time.process_time() - cpu_start,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+    connection.close()
+
+def benchmark_pipeline(input_file: str, num_lines: int, extra_args):
+    with tempfile.TemporaryDirectory() as output_folder:
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        argv = ["--input_file", input_file, "--output_folder", output_folder] + extra_args
+        process = multiprocessing.Process(target=_run_main, args=(argv, sender))
+        process.start()
+        sender.close()
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = None
+        process.join()
+        if process.exitcode != 0 or result is None:
+            return {"error": f"filter.py exited with code {process.exitcode}"}
+    result["lines"] = num_lines
+    result["lines_per_second"] = num_lines / result["seconds"]
+    result["input_mb_per_second"] = os.path.getsize(input_file) / 1e6 / result["seconds"]
+    return result
+
+################################################################
+# Reporting
+################################################################
+
+def compare_with_baseline(results, baseline):
+    """Print the speedup (or slowdown) of every entry found in both runs."""
+    print("\n===== Comparison with baseline =====")
+    for section in ("filters", "pipeline"):
+        for name, current in results.get(section, {}).items():
+            previous = baseline.get(section, {}).get(name)
+            if not previous or not previous.get("lines_per_second") or not current.get("lines_per_second"):
+                continue
+            ratio = current["lines_per_second"] / previous["lines_per_second"]
+            line = f"{section}/{name}: {ratio:.2f}x lines/s"
+            if "peak_rss_mb" in current and "peak_rss_mb" in previous:
+                line += f", peak RSS {previous['peak_rss_mb']:.0f} -> {current['peak_rss_mb']:.0f} MB"
+            flag = "  REGRESSION" if ratio < 0.9 else ""
+            print(line + flag)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the filters and the full pipeline of filter.py.")
+    parser.add_argument('--filter_lines', type=int, default=100000, help='Corpus size for the per-filter benchmarks. Defaults to 100,000.')
+    parser.add_argument('--sizes', default='10000,100000', help='Comma-separated corpus sizes for the pipeline benchmarks, as line counts or sizes such as 10MB. Defaults to 10000,100000.')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions per fast filter benchmark; the best time is kept. Defaults to 3.')
+    parser.add_argument('--spacy_sentences', type=int, default=2000, help='Number of sentences for the spaCy benchmarks. Defaults to 2,000.')
+    parser.add_argument('--skip_spacy', action='store_true', help='Skip the spaCy filter and the pipeline benchmarks (which need the model).')
+    parser.add_argument('--pipeline_args', default='', help='Extra arguments passed to filter.py for the pipeline benchmarks, e.g. "--workers 4".')
+    parser.add_argument('--output_json', help='Write the results to this JSON file.')
+    parser.add_argument('--save_baseline', help='Write the results to this JSON file as the new baseline.')
+    parser.add_argument('--baseline', help='Compare the results with this baseline JSON file.')
+    args = parser.parse_args()
+
+    sentences = load_bundled_sentences()
+    if not sentences:
+        print("Error: no bundled sentences found in " + ", ".join(SAMPLE_FOLDERS))
+        sys.exit(1)
+    model = generate_corpus.WordModel(sentences)
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    try:
+        for size in sizes:
+            if not size.isdigit():
+                generate_corpus.parse_size(size)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    results = {"python": sys.version.split()[0], "filters": {}, "pipeline": {}}
+    with tempfile.TemporaryDirectory() as workdir:
+        filter_corpus = os.path.join(workdir, "filters.tsv")
+        write_corpus(filter_corpus, model, str(args.filter_lines))
+        print(f"Benchmarking filters on {args.filter_lines} lines...")
+        results["filters"] = benchmark_filters(read_corpus(filter_corpus), args.repeat,
+                                               args.spacy_sentences, args.skip_spacy)
+        for name, result in results["filters"].items():
+            print(f"{name:40s} {result['lines_per_second']:>14,.0f} lines/s {result['ns_per_line']:>10,.0f} ns/line")
+
+        if not args.skip_spacy:
+            for seed, size in enumerate(sizes, start=1):
+                corpus = os.path.join(workdir, f"corpus_{size}.tsv")
+                num_lines = write_corpus(corpus, model, size, seed=seed)
+                print(f"Benchmarking pipeline on {size} ({num_lines} lines)...")
+                result = benchmark_pipeline(corpus, num_lines, args.pipeline_args.split())
+                results["pipeline"][f"main_{size}"] = result
+                if "error" in result:
+                    print(f"main_{size}: {result['error']}")
+                else:
+                    print(f"main_{size}: {result['lines_per_second']:,.0f} lines/s, "
+                          f"{result['input_mb_per_second']:.2f} MB/s, peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    for path in (args.output_json, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as outfile:
+                json.dump(results, outfile, indent=2)
+            print(f"Results written to '{path}'.")
+
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            print(f"Error: baseline '{args.baseline}' not found.")
+            sys.exit(1)
+        with open(args.baseline, 'r', encoding='utf-8') as infile:
+            compare_with_baseline(results, json.load(infile))
+
+if __name__ == '__main__':
+    main()
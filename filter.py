@@ -3,20 +3,60 @@ import argparse
 import sys
 import re
 import os
+import multiprocessing
+import time
+import hashlib
+import sqlite3
+import json
+import tracemalloc
+import cProfile
+import pstats
+import functools
+import glob
+import mmap
+import io
+import gzip
+import lzma
+import queue
+import threading
+from array import array
+from collections import deque
 
-# For progress bar:
+# For progress bar (optional):
 try:
     from tqdm import tqdm
 except ImportError:
-    print("Error: 'tqdm' is required for a progress bar. Install with: pip install tqdm")
-    sys.exit(1)
+    class tqdm:
+        """Stand-in for tqdm when it is not installed: no progress bar."""
+        def __init__(self, iterable=None, **kwargs):
+            self.iterable = iterable
 
-# For spaCy-based filtering:
-try:
-    import spacy
-except ImportError:
-    print("Error: spaCy is required. Install with: pip install spacy")
-    sys.exit(1)
+        def __iter__(self):
+            return iter(self.iterable)
+
+        def update(self, n=1):
+            pass
+
+# For spaCy-based filtering. spaCy is imported on first use (see
+# import_spacy), so runs that never touch the model start quickly.
+spacy = None
+
+def import_spacy():
+    """Import spaCy once, exiting with an install hint if it is missing."""
+    global spacy
+    if spacy is None:
+        try:
+            import spacy
+        except ImportError:
+            print("Error: spaCy is required. Install with: pip install spacy")
+            sys.exit(1)
+    return spacy
+
+SPACY_MODEL = "nb_core_news_sm"
+
+# Components the PROPN decision does not depend on. token.pos_ is set by the
+# morphologizer (and adjusted by the attribute_ruler), both fed by tok2vec.
+MINIMAL_PIPELINE_EXCLUDE = ["parser", "lemmatizer", "ner", "senter"]
 
 ################################################################
 # Filters (fast first, then spaCy/slow filters at the end)
@@ -44,10 +84,13 @@ def only_one_sentence(sentence: str) -> bool:
 def has_no_numbers(sentence: str) -> bool:
     return not any(char.isdigit() for char in sentence)
 
+# Allow letters, typical Norwegian chars, whitespace, punctuation
+ALLOWED_CHARACTERS = r'a-zA-ZæøåÆØÅ\s,.!?\'’:;\-'
+_ALLOWED_RE = re.compile(rf'^[{ALLOWED_CHARACTERS}]*$', re.UNICODE)
+_DISALLOWED_RE = re.compile(rf'[^{ALLOWED_CHARACTERS}]', re.UNICODE)
+
 def no_special_characters(sentence: str) -> bool:
-    # Allow letters, typical Norwegian chars, whitespace, punctuation
-    pattern = r'^[a-zA-ZæøåÆØÅ\s,.!?\'’:;\-]*$'
-    return re.fullmatch(pattern, sentence, re.UNICODE) is not None
+    return _ALLOWED_RE.fullmatch(sentence) is not None
 
 def reading_time_filter(sentence: str, wpm: int = 100, min_sec: int = 2, max_sec: int = 7) -> bool:
     """
@@ -79,6 +122,290 @@ def basic_proper_noun_filter(sentence: str) -> bool:
                 return False
     return True
 
+# Fast filters (applied before spaCy to reduce overhead), in the order
+# used to attribute each rejection to the first filter it fails.
+FAST_FILTERS = [
+    (starts_with_capital, "starts_with_capital"),
+    (has_no_parentheses, "has_no_parentheses"),
+    (ends_with_punctuation, "ends_with_punctuation"),
+    (only_one_sentence, "only_one_sentence"),
+    (has_no_numbers, "has_no_numbers"),
+    (no_special_characters, "no_special_characters"),
+    (reading_time_filter, "reading_time_filter"),
+    (max_word_count_filter, "max_word_count_filter"),
+    (basic_proper_noun_filter, "basic_proper_noun_filter")
+]
+
+def create_fast_filter_chain(fast_filters):
+    """
+    Return a function that runs fast_filters in order on a sentence and
+    returns the name of the first filter it fails, or None if it passes.
+    """
+    def fast_filter_chain(sentence: str):
+        for filter_func, filter_name in fast_filters:
+            if not filter_func(sentence):
+                return filter_name
+        return None
+    return fast_filter_chain
+
+def create_adaptive_fast_filter_chain(fast_filters, sample_size: int = 10000):
+    """
+    Return a fast filter chain (see create_fast_filter_chain) that reorders
+    itself to minimize the expected cost per sentence.
+
+    The first sample_size sentences run every filter, in the given order, to
+    measure each filter's cost per call and rejection rate. The chain is then
+    sorted by cost / rejection rate, so cheap filters that reject a lot run
+    first. Acceptance is unchanged, but a sentence failing several filters is
+    attributed to the first one in the new order. The order in use is
+    available as the function's filter_order attribute.
+    """
+    costs = [0.0] * len(fast_filters)
+    rejections = [0] * len(fast_filters)
+    sampled = 0
+    ordered_filters = list(fast_filters)
+
+    def adaptive_fast_filter_chain(sentence: str):
+        nonlocal sampled, ordered_filters
+        if sampled >= sample_size:
+            for filter_func, filter_name in ordered_filters:
+                if not filter_func(sentence):
+                    return filter_name
+            return None
+
+        first_failed = None
+        for i, (filter_func, filter_name) in enumerate(fast_filters):
+            start = time.perf_counter()
+            passed = filter_func(sentence)
+            costs[i] += time.perf_counter() - start
+            if not passed:
+                rejections[i] += 1
+                if first_failed is None:
+                    first_failed = filter_name
+        sampled += 1
+
+        if sampled == sample_size:
+            def expected_cost(i):
+                # Filters that never rejected anything in the sample go last.
+                if rejections[i] == 0:
+                    return float('inf')
+                return costs[i] / rejections[i]
+            order = sorted(range(len(fast_filters)), key=expected_cost)
+            ordered_filters = [fast_filters[i] for i in order]
+            adaptive_fast_filter_chain.filter_order = [name for _, name in ordered_filters]
+        return first_failed
+
+    adaptive_fast_filter_chain.filter_order = [name for _, name in fast_filters]
+    return adaptive_fast_filter_chain
+
+def fused_fast_filters(sentence: str, wpm: int = 100, min_sec: int = 2, max_sec: int = 7, max_words: int = 14):
+    """
+    Equivalent to the FAST_FILTERS chain, but strips and splits the sentence
+    once and checks digits and the allowed alphabet in a single regex scan.
+    Returns the name of the first failing filter, or None.
+    """
+    stripped = sentence.strip()
+    if not stripped or not stripped[0].isupper():
+        return "starts_with_capital"
+    if '(' in stripped or ')' in stripped:
+        return "has_no_parentheses"
+    if stripped[-1] not in {'.', '?'}:
+        return "ends_with_punctuation"
+    if stripped.count('.') + stripped.count('?') != 1:
+        return "only_one_sentence"
+
+    # Digits are never in the allowed alphabet, so only the disallowed
+    # characters need to be checked for digits.
+    disallowed = _DISALLOWED_RE.findall(stripped)
+    if disallowed:
+        if any(char.isdigit() for char in disallowed):
+            return "has_no_numbers"
+        return "no_special_characters"
+
+    words = stripped.split()
+    effective_word_count = sum(2 if len(w) > 10 else 1 for w in words)
+    reading_time = effective_word_count / (wpm / 60.0)
+    if not min_sec <= reading_time <= max_sec:
+        return "reading_time_filter"
+    if len(words) > max_words:
+        return "max_word_count_filter"
+    for word in words[1:]:
+        if word[0].isupper():
+            return "basic_proper_noun_filter"
+    return None
+
+def create_fast_filter_engine(fast_engine: str, fast_filters=FAST_FILTERS, adaptive_sample_size: int = 10000):
+    """
+    Return the first-failing-filter function for a --fast_engine name
+    ('fused', 'chain' or 'adaptive'). For 'columnar' the function classifies
+    a whole batch of sentences (see create_columnar_fast_filters). Raises
+    ImportError if the columnar engine's dependencies are missing.
+    """
+    if fast_engine == 'fused':
+        return fused_fast_filters
+    if fast_engine == 'columnar':
+        return create_columnar_fast_filters()
+    if fast_engine == 'adaptive':
+        return create_adaptive_fast_filter_chain(fast_filters, adaptive_sample_size)
+    return create_fast_filter_chain(fast_filters)
+
+################################################################
+# Columnar fast filters
+################################################################
+
+def _regex_char_class(characters: str) -> str:
+    """Return the body of an RE2 character class matching exactly characters."""
+    ranges = []
+    for code_point in sorted(set(map(ord, characters))):
+        if ranges and ranges[-1][1] == code_point - 1:
+            ranges[-1][1] = code_point
+        else:
+            ranges.append([code_point, code_point])
+    return ''.join(f'\\x{{{a:X}}}' if a == b else f'\\x{{{a:X}}}-\\x{{{b:X}}}' for a, b in ranges)
+
+@functools.lru_cache(maxsize=None)
+def _all_characters() -> str:
+    """Every code point that can occur in decoded UTF-8 text (no surrogates)."""
+    code_points = array('I', range(0xD800)) + array('I', range(0xE000, 0x110000))
+    return code_points.tobytes().decode(f'utf-32-{sys.byteorder[0]}e')
+
+@functools.lru_cache(maxsize=None)
+def _python_whitespace() -> str:
+    """The characters str.strip() and str.split() treat as whitespace."""
+    return ''.join(filter(str.isspace, _all_characters()))
+
+def create_columnar_fast_filters(wpm: int = 100, min_sec: int = 2, max_sec: int = 7, max_words: int = 14):
+    """
+    Return a function mapping an Arrow string array of sentences to a NumPy
+    array with, for each sentence, 0 if it passes every fast filter or else
+    i + 1 for the first filter FAST_FILTERS[i] it fails. The checks of
+    fused_fast_filters run as Arrow string kernels over the whole array,
+    each on the sentences that passed the checks before it.
+
+    The character classes (uppercase, digits, whitespace and the allowed
+    alphabet) are generated from Python's own str methods and regexes, so
+    every sentence is attributed to the same filter as by FAST_FILTERS.
+    Raises ImportError if pyarrow or numpy is not installed.
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    all_characters = _all_characters()
+    whitespace = _python_whitespace()
+    uppercase_set = pa.array(list(filter(str.isupper, all_characters)), type=pa.string())
+    digit = _regex_char_class(''.join(filter(str.isdigit, all_characters)))
+    allowed_characters = _DISALLOWED_RE.sub('', all_characters)
+    allowed = _regex_char_class(allowed_characters)
+    # Once the alphabet check has passed, only allowed characters are left,
+    # which keeps the remaining character classes small
+    space = _regex_char_class(whitespace)
+    other_space = _regex_char_class(whitespace.replace(' ', ''))
+    allowed_word = _regex_char_class(''.join(char for char in allowed_characters if not char.isspace()))
+    allowed_upper = _regex_char_class(''.join(filter(str.isupper, allowed_characters)))
+
+    def flag(array):
+        return array.to_numpy(zero_copy_only=False)
+
+    def count(array):
+        return array.to_numpy(zero_copy_only=False).astype(np.int64)
+
+    def columnar_fast_filters(sentences):
+        codes = np.zeros(len(sentences), dtype=np.int8)
+        rows = np.arange(len(sentences))
+        current = pc.utf8_trim(sentences, characters=whitespace)
+
+        def reject(code, failed):
+            # Record the failing rows and keep checking the others
+            nonlocal rows, current
+            codes[rows[failed]] = code
+            passed = ~failed
+            rows = rows[passed]
+            current = current.filter(passed)
+            return passed
+
+        reject(1, ~flag(pc.is_in(pc.utf8_slice_codeunits(current, 0, 1), value_set=uppercase_set)))
+        reject(2, flag(pc.match_substring_regex(current, '[()]')))
+        reject(3, ~(flag(pc.ends_with(current, '.')) | flag(pc.ends_with(current, '?'))))
+        # The sentence ends with '.' or '?', so it has exactly one if no
+        # other character follows one
+        reject(4, flag(pc.match_substring_regex(current, r'(?s)[.?].')))
+        # Digits are never in the allowed alphabet, so only sentences with
+        # disallowed characters need to be checked for digits
+        disallowed = flag(pc.match_substring_regex(current, f'[^{allowed}]'))
+        has_digit = np.zeros(len(disallowed), dtype=bool)
+        has_digit[disallowed] = flag(pc.match_substring_regex(current.filter(disallowed), f'[{digit}]'))
+        reject(5, has_digit)
+        reject(6, disallowed[~has_digit])
+
+        # Words are separated by single spaces in almost every sentence;
+        # the rest are split in Python
+        words = count(pc.count_substring(current, ' ')) + 1
+        long_words = count(pc.count_substring_regex(current, f'[{allowed_word}]{{11,}}'))
+        for i in np.flatnonzero(flag(pc.match_substring_regex(current, f'[{other_space}]|  '))).tolist():
+            split_words = current[i].as_py().split()
+            words[i] = len(split_words)
+            long_words[i] = sum(1 for w in split_words if len(w) > 10)
+        reading_time = (words + long_words) / (wpm / 60.0)
+        passed = reject(7, (reading_time < min_sec) | (reading_time > max_sec))
+        reject(8, words[passed] > max_words)
+        reject(9, flag(pc.match_substring_regex(current, f'[{space}][{allowed_upper}]')))
+        return codes
+    return columnar_fast_filters
+
+def read_sentence_columns(input_file: str, start_offset: int = 0, end_offset=None, block_size: int = 4 << 20,
+                          progress=None):
+    """
+    Columnar counterpart of read_sentences: yield (offsets, sentences) for
+    blocks of about block_size bytes, with the offsets as a NumPy array and
+    the sentences as an Arrow string array. Each block is split into lines
+    and columns by Arrow kernels, without a Python call per line. Blocks
+    with a '\\r' or invalid UTF-8 go through split_sentences instead, so the
+    result (and any decoding error) is always the same. progress, if given,
+    is called with the number of bytes of each block.
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    whitespace = _python_whitespace()
+    with open_input(input_file, start_offset) as infile:
+        position = start_offset
+        while end_offset is None or position < end_offset:
+            block = infile.read(block_size if end_offset is None else min(block_size, end_offset - position))
+            if not block:
+                break
+            if not block.endswith(b'\n'):
+                block += infile.readline()
+            block_start = position
+            position += len(block)
+            if progress is not None:
+                progress(len(block))
+
+            line_ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10) + 1
+            if not block.endswith(b'\n'):
+                line_ends = np.append(line_ends, len(block))
+            lines = pa.StringArray.from_buffers(
+                len(line_ends),
+                pa.py_buffer(np.concatenate(([0], line_ends)).astype(np.int32)),
+                pa.py_buffer(block))
+            try:
+                lines.validate(full=True)
+                simple = b'\r' not in block
+            except pa.ArrowInvalid:
+                simple = False
+            if not simple:
+                records = list(split_sentences(io.BytesIO(block), block_start))
+                yield (np.array([offset for offset, _ in records], dtype=np.int64),
+                       pa.array([sentence for _, sentence in records], type=pa.string()))
+                continue
+
+            lines = pc.utf8_trim(lines, characters=whitespace)
+            has_columns = pc.match_substring(lines, '\t').to_numpy(zero_copy_only=False)
+            second_column = pc.list_element(pc.split_pattern(lines.filter(has_columns), '\t'), 1)
+            yield (line_ends[has_columns] + block_start,
+                   pc.utf8_trim(second_column, characters=whitespace))
+
 def create_proper_noun_filter(nlp):
     """
     Return a function that filters out sentences containing proper nouns (PROPN).
@@ -88,21 +415,2075 @@ def create_proper_noun_filter(nlp):
         return not any(token.pos_ == 'PROPN' for token in doc)
     return proper_noun_filter
 
+def propn_spans(doc):
+    """Return the (start, end) character spans of the PROPN tokens of a spaCy doc."""
+    return [(token.idx, token.idx + len(token)) for token in doc if token.pos_ == 'PROPN']
+
+def tag_propn(nlp, sentences, batch_size: int = 256, sort_by_length: bool = False):
+    """
+    Return the PROPN spans (see propn_spans) of each sentence, running
+    nlp.pipe in batches of batch_size. With sort_by_length, the sentences
+    are tagged shortest first so that each batch holds sentences of
+    similar length (less padding), and the spans are returned in input
+    order.
+    """
+    if not sort_by_length:
+        return [propn_spans(doc) for doc in nlp.pipe(sentences, batch_size=batch_size)]
+    order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+    spans = [None] * len(sentences)
+    for i, doc in zip(order, nlp.pipe([sentences[i] for i in order], batch_size=batch_size)):
+        spans[i] = propn_spans(doc)
+    return spans
+
+def create_batched_proper_noun_filter(nlp, batch_size: int = 256, cache=None, lexicon=None, length_buckets: int = 1):
+    """
+    Return a function that takes an iterable of sentences and yields
+    (sentence, accepted) pairs in input order, running the PROPN check
+    through nlp.pipe in batches of batch_size. With a PropnLexicon and/or a
+    PropnCache, sentences they can decide are not passed to spaCy (see
+    prejudge_propn), and the spaCy results are fed back to them. With
+    length_buckets > 1, that many batches are pooled and sorted by length
+    before tagging (see tag_propn).
+    """
+    window = batch_size * length_buckets
+
+    def batched_proper_noun_filter(sentences):
+        if cache is None and lexicon is None and length_buckets == 1:
+            for doc in nlp.pipe(sentences, batch_size=batch_size):
+                yield doc.text, not any(token.pos_ == 'PROPN' for token in doc)
+            return
+
+        for batch in iter_batches(sentences, window):
+            decisions = prejudge_propn(batch, cache, lexicon)
+            misses = [sentence for sentence, accepted in zip(batch, decisions) if accepted is None]
+            if misses:
+                spans = tag_propn(nlp, misses, batch_size, length_buckets > 1)
+                decisions = fill_cache_misses(decisions, record_propn_results(misses, spans, cache, lexicon))
+            yield from zip(batch, decisions)
+    return batched_proper_noun_filter
+
+def load_spacy_model(minimal: bool = False):
+    """
+    Load the Norwegian spaCy model. With minimal=True, every component the
+    POS tags do not need is excluded, which makes both loading and tagging
+    cheaper. Raises OSError if the model is not installed.
+    """
+    import_spacy()
+    if minimal:
+        return spacy.load(SPACY_MODEL, exclude=MINIMAL_PIPELINE_EXCLUDE)
+    return spacy.load(SPACY_MODEL)
+
+def check_minimal_pipeline(sample_folder: str, batch_size: int = 256):
+    """
+    Compare the PROPN decisions of the minimal and the full pipeline on the
+    sentences (first column) of every TSV file in sample_folder. Returns the
+    number of sentences checked and the list of sentences where they differ.
+    """
+    sentences = []
+    for filename in sorted(os.listdir(sample_folder)):
+        if not filename.endswith('.tsv'):
+            continue
+        with open(os.path.join(sample_folder, filename), 'r', encoding='utf-8') as infile:
+            for line in infile:
+                sentence = line.split('\t')[0].strip()
+                if sentence:
+                    sentences.append(sentence)
+
+    full_filter = create_batched_proper_noun_filter(load_spacy_model(), batch_size)
+    minimal_filter = create_batched_proper_noun_filter(load_spacy_model(minimal=True), batch_size)
+
+    mismatches = []
+    for (sentence, full_accepted), (_, minimal_accepted) in zip(full_filter(sentences), minimal_filter(sentences)):
+        if full_accepted != minimal_accepted:
+            mismatches.append(sentence)
+    return len(sentences), mismatches
+
+################################################################
+# Persistent cache of spaCy PROPN decisions
+################################################################
+
+def iter_batches(iterable, batch_size: int):
+    """Yield lists of up to batch_size consecutive items from iterable."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def fill_cache_misses(decisions, results):
+    """Replace the None entries of decisions, in order, with results."""
+    results = iter(results)
+    return [next(results) if accepted is None else accepted for accepted in decisions]
+
+def prejudge_propn(batch, cache=None, lexicon=None):
+    """
+    Return the PROPN decision for each sentence of batch that is known
+    without spaCy, or None: sentences the PropnLexicon considers safe are
+    accepted, and the rest are looked up in the PropnCache.
+    """
+    decisions = [None] * len(batch) if lexicon is None else lexicon.prejudge(batch)
+    if cache is not None:
+        unknown = [sentence for sentence, accepted in zip(batch, decisions) if accepted is None]
+        if unknown:
+            decisions = fill_cache_misses(decisions, cache.lookup(unknown))
+    return decisions
+
+def record_propn_results(sentences, spans, cache=None, lexicon=None):
+    """
+    Turn the PROPN spans spaCy found in each sentence into decisions, and
+    store them in the cache and the lexicon. Returns the decisions.
+    """
+    results = [not sentence_spans for sentence_spans in spans]
+    if cache is not None:
+        cache.store(sentences, results)
+    if lexicon is not None:
+        lexicon.observe(sentences, spans)
+    return results
+
+def spacy_model_key(minimal: bool = False) -> str:
+    """
+    Identify the installed spaCy model (name, version and pipeline variant),
+    so cached decisions are never reused across model versions.
+    """
+    import_spacy()
+    version = spacy.util.get_package_version(SPACY_MODEL) or "unknown"
+    return f"{SPACY_MODEL}-{version}{'-minimal' if minimal else ''}"
+
+class PropnCache:
+    """
+    SQLite-backed store of proper_noun_filter decisions, keyed by a hash of
+    the model key and the sentence text. It survives between runs, so
+    sentences judged before never go through spaCy again.
+
+    With --pipeline_threads it is used from the spaCy stage thread and
+    closed from the main thread, so the connection is shared between
+    threads and guarded by a lock.
+    """
+    # Stay below SQLite's limit on the number of parameters per statement.
+    MAX_LOOKUP_PARAMS = 900
+
+    def __init__(self, path: str, model_key: str):
+        self.model_key = model_key
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS propn_decisions ("
+            "key BLOB PRIMARY KEY, accepted INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def _key(self, sentence: str) -> bytes:
+        return hashlib.blake2b(f"{self.model_key}\0{sentence}".encode('utf-8'), digest_size=16).digest()
+
+    def lookup(self, sentences):
+        """Return the cached decision for each sentence, or None if unknown."""
+        keys = [self._key(sentence) for sentence in sentences]
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), self.MAX_LOOKUP_PARAMS):
+                part = keys[i : i + self.MAX_LOOKUP_PARAMS]
+                placeholders = ','.join('?' * len(part))
+                rows = self.conn.execute(
+                    f"SELECT key, accepted FROM propn_decisions WHERE key IN ({placeholders})", part
+                )
+                found.update((key, bool(accepted)) for key, accepted in rows)
+        decisions = [found.get(key) for key in keys]
+        misses = decisions.count(None)
+        self.hits += len(keys) - misses
+        self.misses += misses
+        return decisions
+
+    def store(self, sentences, decisions):
+        rows = [(self._key(sentence), int(accepted)) for sentence, accepted in zip(sentences, decisions)]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO propn_decisions (key, accepted) VALUES (?, ?)", rows)
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+################################################################
+# PROPN lexicon
+################################################################
+
+# Tokens the lexicon counts: runs of word characters and single symbols
+_LEXICON_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+class PropnLexicon:
+    """
+    SQLite-backed lexicon of word forms learned from spaCy results: for
+    each form (case-sensitive, per model key), how often it was seen and
+    how often it was part of a PROPN token. It is updated with every
+    sentence spaCy tags and survives between runs.
+
+    A sentence whose forms were all seen at least min_count times, and
+    tagged PROPN in at most max_propn_rate of them, is accepted without
+    running spaCy. With verify=True no sentence is skipped; instead, every
+    sentence spaCy tags is first judged by the lexicon, and the sentences
+    it would have accepted although spaCy found a PROPN are counted.
+
+    With --pipeline_threads, observe() runs on the spaCy stage thread while
+    checkpoints save() from the main thread; a lock keeps the unsaved
+    counts consistent between the two.
+    """
+    MAX_EXAMPLES = 10
+
+    def __init__(self, path: str, model_key: str, min_count: int = 50, max_propn_rate: float = 0.0,
+                 verify: bool = False):
+        self.model_key = model_key
+        self.min_count = min_count
+        self.max_propn_rate = max_propn_rate
+        self.verify = verify
+        self.skipped = 0
+        self.verified = 0
+        self.disagreements = 0
+        self.disagreement_examples = []
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS propn_lexicon ("
+            "model_key TEXT NOT NULL, form TEXT NOT NULL, count INTEGER NOT NULL, propn INTEGER NOT NULL, "
+            "PRIMARY KEY (model_key, form)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+        # {form: [count, propn]}, and the increments not saved yet
+        self.forms = {form: [count, propn] for form, count, propn in self.conn.execute(
+            "SELECT form, count, propn FROM propn_lexicon WHERE model_key = ?", (model_key,))}
+        self._unsaved = {}
+
+    def is_safe(self, sentence: str) -> bool:
+        """Whether every form of sentence is confidently not a proper noun."""
+        forms = self.forms
+        for form in _LEXICON_TOKEN_RE.findall(sentence):
+            entry = forms.get(form)
+            if entry is None or entry[0] < self.min_count or entry[1] > self.max_propn_rate * entry[0]:
+                return False
+        return True
+
+    def prejudge(self, sentences):
+        """Return True (accepted) for each safe sentence and None for the rest."""
+        if self.verify:
+            return [None] * len(sentences)
+        decisions = [True if self.is_safe(sentence) else None for sentence in sentences]
+        self.skipped += len(decisions) - decisions.count(None)
+        return decisions
+
+    def observe(self, sentences, spans):
+        """Learn from the PROPN spans spaCy found in each sentence (see propn_spans)."""
+        with self.lock:
+            self._observe(sentences, spans)
+
+    def _observe(self, sentences, spans):
+        for sentence, sentence_spans in zip(sentences, spans):
+            if self.verify and self.is_safe(sentence):
+                self.verified += 1
+                if sentence_spans:
+                    self.disagreements += 1
+                    if len(self.disagreement_examples) < self.MAX_EXAMPLES:
+                        self.disagreement_examples.append(sentence)
+            for match in _LEXICON_TOKEN_RE.finditer(sentence):
+                propn = any(start < match.end() and match.start() < end for start, end in sentence_spans)
+                for counts in (self.forms, self._unsaved):
+                    entry = counts.get(match.group())
+                    if entry is None:
+                        entry = counts[match.group()] = [0, 0]
+                    entry[0] += 1
+                    entry[1] += propn
+
+    def save(self):
+        """Add the counts learned since the last save to the database."""
+        with self.lock:
+            unsaved, self._unsaved = self._unsaved, {}
+        self.conn.executemany(
+            "INSERT INTO propn_lexicon (model_key, form, count, propn) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (model_key, form) DO UPDATE SET "
+            "count = count + excluded.count, propn = propn + excluded.propn",
+            [(self.model_key, form, count, propn) for form, (count, propn) in unsaved.items()]
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.save()
+        self.conn.close()
+
+################################################################
+# Duplicate elimination
+################################################################
+
+def sentence_hash64(sentence: str) -> int:
+    """Stable 64-bit hash of a sentence (the same in every process and run)."""
+    return int.from_bytes(hashlib.blake2b(sentence.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class CompactHashSet:
+    """
+    Open-addressing set of non-zero 64-bit integers stored in a flat
+    array('Q'): about 16 bytes per entry, a fraction of a Python set of ints.
+    """
+    def __init__(self, capacity: int = 1 << 16):
+        size = 1
+        while size < capacity * 2:
+            size <<= 1
+        self.table = array('Q', bytes(8 * size))
+        self.mask = size - 1
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value: int) -> bool:
+        """Insert value (0 is mapped to 1). Returns False if it was already present."""
+        value = value or 1
+        table, mask = self.table, self.mask
+        i = value & mask
+        while True:
+            slot = table[i]
+            if slot == 0:
+                break
+            if slot == value:
+                return False
+            i = (i + 1) & mask
+        table[i] = value
+        self.count += 1
+        if self.count * 2 > len(table):
+            self._grow()
+        return True
+
+    def dump(self, outfile):
+        """Write the table to a binary file (see load)."""
+        self.table.tofile(outfile)
+
+    def load(self, infile, size: int, count: int):
+        """Replace the contents with a table of size slots holding count values, written by dump."""
+        self.table = array('Q')
+        self.table.fromfile(infile, size)
+        self.mask = size - 1
+        self.count = count
+
+    def _grow(self):
+        old_table = self.table
+        self.table = array('Q', bytes(16 * len(old_table)))
+        self.mask = len(self.table) - 1
+        self.count = 0
+        for value in old_table:
+            if value:
+                self.add(value)
+
+class ExactDeduplicator:
+    """Remembers a 64-bit hash of every sentence seen and flags exact repeats."""
+    def __init__(self):
+        self.seen = CompactHashSet()
+
+    def duplicates(self, sentences):
+        """Return, for each sentence in order, whether it was seen before."""
+        add = self.seen.add
+        return [not add(sentence_hash64(sentence)) for sentence in sentences]
+
+    def hash_sets(self):
+        return [self.seen]
+
+def _mix64(np, values):
+    """splitmix64 finalizer over a uint64 array: a bijection that spreads every input bit."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+class NearDeduplicator:
+    """
+    MinHash/LSH near-duplicate detection over character shingles of the
+    lowercased, whitespace-normalized sentence. Each sentence's signature is
+    split into bands; a sentence sharing any band with an earlier one is a
+    near duplicate. Only one 64-bit hash per band is kept per sentence.
+    With the defaults (64 hashes, 8 bands of 8) sentences with a Jaccard
+    similarity above roughly 0.8 are flagged.
+
+    Sentences are hashed with NumPy, SIGNATURE_BATCH_SIZE at a time:
+    shingle hashes, signatures and band hashes are each computed for the
+    whole batch at once, and only the band lookups run per sentence.
+    Raises ImportError if numpy is not installed.
+    """
+    # Sentences per NumPy pass; small enough that the (shingles x num_perm)
+    # signature array stays in the CPU cache
+    SIGNATURE_BATCH_SIZE = 64
+
+    def __init__(self, num_perm: int = 64, bands: int = 8, shingle_size: int = 4, seed: int = 1):
+        import numpy as np
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.np = np
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        # Deterministic hash functions (a * x + b) mod 2**64 with odd a,
+        # derived from the seed
+        a_values = []
+        b_values = []
+        for i in range(num_perm):
+            digest = hashlib.blake2b(f"{seed}:{i}".encode('ascii'), digest_size=16).digest()
+            a_values.append(int.from_bytes(digest[:8], 'little') | 1)
+            b_values.append(int.from_bytes(digest[8:], 'little'))
+        self._a = np.array(a_values, dtype=np.uint64)
+        self._b = np.array(b_values, dtype=np.uint64)
+        self.band_sets = [CompactHashSet() for _ in range(bands)]
+
+    def _shingles(self, sentences):
+        """
+        Return the 64-bit hashes of the shingles of all sentences, one
+        after the other, and the index of each sentence's first shingle.
+        A text shorter than a shingle is padded to one shingle.
+        """
+        np = self.np
+        n = self.shingle_size
+        texts = [' '.join(sentence.lower().split()).ljust(n, '\0') for sentence in sentences]
+        codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        lengths = np.array([len(text) for text in texts], dtype=np.int64)
+        counts = lengths - (n - 1)
+        starts = np.cumsum(counts) - counts
+        # Position of each shingle's first character in codes
+        positions = np.arange(int(counts.sum())) + np.repeat(np.cumsum(lengths) - lengths - starts, counts)
+        hashes = np.zeros(len(positions), dtype=np.uint64)
+        for k in range(n):
+            hashes = _mix64(np, hashes ^ codes[positions + k])
+        return hashes, starts
+
+    def _signatures(self, sentences):
+        """MinHash signature of each sentence: the minimum of each hash function over its shingles."""
+        np = self.np
+        shingles, starts = self._shingles(sentences)
+        values = np.multiply(shingles[:, None], self._a)
+        values += self._b
+        return np.minimum.reduceat(values, starts, axis=0)
+
+    def duplicates(self, sentences):
+        """
+        Return, for each sentence in order, whether it shares a band with an
+        earlier sentence (including earlier sentences of the same batch).
+        """
+        if not sentences:
+            return []
+        np = self.np
+        signatures = np.concatenate([self._signatures(sentences[i : i + self.SIGNATURE_BATCH_SIZE])
+                                     for i in range(0, len(sentences), self.SIGNATURE_BATCH_SIZE)])
+        signatures = signatures.reshape(len(sentences), self.bands, self.rows)
+        band_hashes = np.zeros((len(sentences), self.bands), dtype=np.uint64)
+        for row in range(self.rows):
+            band_hashes = _mix64(np, band_hashes ^ signatures[:, :, row])
+        result = []
+        for sentence_hashes in band_hashes.tolist():
+            duplicate = False
+            for band_set, band_hash in zip(self.band_sets, sentence_hashes):
+                if not band_set.add(band_hash):
+                    duplicate = True
+            result.append(duplicate)
+        return result
+
+    def hash_sets(self):
+        return self.band_sets
+
+def apply_dedup(records, deduplicator, filter_name, batch_size: int = 256):
+    """
+    Pipeline stage (see apply_fast_filters) that drops sentences the
+    deduplicator has seen before, counting them against filter_name.
+    Sentences are checked batch_size at a time.
+    """
+    def dedup_filter(sentences):
+        for batch in iter_batches(sentences, batch_size):
+            yield from zip(batch, (not duplicate for duplicate in deduplicator.duplicates(batch)))
+    return apply_batched_filter(records, dedup_filter, filter_name)
+
+################################################################
+# Multi-process spaCy filtering
+################################################################
+
+def pool_context(threaded: bool):
+    """
+    Return the multiprocessing context to create worker pools with. With
+    --pipeline_threads the pools are created in stage threads while other
+    threads run, and forking then could copy a lock another thread holds
+    into the worker, so the workers are started by a forkserver (or spawned,
+    where there is none) instead.
+    """
+    if not threaded:
+        return multiprocessing.get_context()
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+# Per-process state, set up once by _init_spacy_worker in each pool worker.
+_worker_nlp = None
+_worker_batch_size = None
+_worker_sort_by_length = False
+_worker_error = None
+
+def _init_spacy_worker(batch_size: int, minimal: bool, sort_by_length: bool = False):
+    global _worker_nlp, _worker_batch_size, _worker_sort_by_length, _worker_error
+    _worker_batch_size = batch_size
+    _worker_sort_by_length = sort_by_length
+    try:
+        _worker_nlp = load_spacy_model(minimal)
+    except OSError as e:
+        _worker_error = str(e)
+
+def _spacy_worker_batch(sentences):
+    if _worker_nlp is None:
+        raise RuntimeError(f"Worker could not load spaCy model '{SPACY_MODEL}': {_worker_error}")
+    return tag_propn(_worker_nlp, sentences, _worker_batch_size, _worker_sort_by_length)
+
+def create_parallel_proper_noun_filter(workers: int, batch_size: int = 256, minimal: bool = False, cache=None,
+                                       lexicon=None, length_buckets: int = 1, context=None):
+    """
+    Return a batched PROPN filter (see create_batched_proper_noun_filter)
+    that spreads the sentences over a pool of worker processes. Each worker
+    loads the spaCy model once. Results are yielded in input order, and at
+    most a few batches per worker are in flight at any time. The
+    PropnLexicon and PropnCache are used in the main process, and only the
+    sentences they cannot decide are sent to the workers. With
+    length_buckets > 1, each worker task holds that many batches, which the
+    worker sorts by length before tagging. context is the multiprocessing
+    context the pool is created with (see pool_context).
+    """
+    window = batch_size * length_buckets
+    context = context or multiprocessing.get_context()
+
+    def parallel_proper_noun_filter(sentences):
+        max_pending = workers * 2
+        pending = deque()
+
+        def finish_oldest():
+            batch, decisions, misses, result = pending.popleft()
+            if result is not None:
+                results = record_propn_results(misses, result.get(), cache, lexicon)
+                decisions = fill_cache_misses(decisions, results)
+            return zip(batch, decisions)
+
+        with context.Pool(workers, initializer=_init_spacy_worker,
+                          initargs=(batch_size, minimal, length_buckets > 1)) as pool:
+            for batch in iter_batches(sentences, window):
+                decisions = prejudge_propn(batch, cache, lexicon)
+                misses = [sentence for sentence, accepted in zip(batch, decisions) if accepted is None]
+                result = pool.apply_async(_spacy_worker_batch, (misses,)) if misses else None
+                pending.append((batch, decisions, misses, result))
+                if len(pending) >= max_pending:
+                    yield from finish_oldest()
+            while pending:
+                yield from finish_oldest()
+    return parallel_proper_noun_filter
+
+################################################################
+# Compressed input and output
+################################################################
+
+# Compression by file extension, e.g. corpus.tsv.gz
+COMPRESSION_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.zst': 'zstd',
+    '.xz': 'xz',
+}
+
+def input_compression(input_file: str):
+    """Return 'gzip', 'zstd' or 'xz' for a compressed input file, else None."""
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(input_file)[1].lower())
+
+def open_decompressed(path: str, compression: str):
+    """Open a compressed file for reading its decompressed bytes."""
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'xz':
+        return lzma.open(path, 'rb')
+    import zstandard
+    return zstandard.open(path, 'rb')
+
+def open_compressor(outfile, compression: str):
+    """
+    Wrap the binary file outfile in a compressing stream. Closing the stream
+    finishes the compressed data but leaves outfile open.
+    """
+    if compression == 'gzip':
+        # A fixed mtime keeps the output identical between runs
+        return gzip.GzipFile(fileobj=outfile, mode='wb', mtime=0)
+    if compression == 'xz':
+        return lzma.LZMAFile(outfile, 'wb')
+    import zstandard
+    return zstandard.ZstdCompressor().stream_writer(outfile, closefd=False)
+
+class ThreadedReader(io.RawIOBase):
+    """
+    Raw stream over source whose data is read (e.g. decompressed) by a
+    background thread, up to max_chunks chunks of chunk_size bytes ahead,
+    so decompression overlaps with the work done on the data. Wrap it in an
+    io.BufferedReader for line iteration. Closing it closes source.
+    """
+    def __init__(self, source, chunk_size: int = 1 << 20, max_chunks: int = 8):
+        self._source = source
+        self._queue = queue.Queue(max_chunks)
+        self._stop = threading.Event()
+        self._chunk = memoryview(b'')
+        self._eof = False
+        self._thread = threading.Thread(target=self._fill, args=(chunk_size,), daemon=True)
+        self._thread.start()
+
+    def _fill(self, chunk_size: int):
+        try:
+            while True:
+                data = self._source.read(chunk_size)
+                if not self._put(data) or not data:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item) -> bool:
+        # Give up once the reader is closed, instead of blocking forever
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self._chunk:
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._chunk = memoryview(item)
+        n = min(len(buffer), len(self._chunk))
+        buffer[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._source.close()
+        super().close()
+
+def open_input(input_file: str, start_offset: int = 0, buffer_size: int = 1 << 20):
+    """
+    Open a TSV input file for binary reading at start_offset. Compressed
+    input (see input_compression) is decompressed on a background thread;
+    offsets count decompressed bytes, and start_offset is reached by
+    decompressing and skipping everything before it.
+    """
+    compression = input_compression(input_file)
+    if compression is None:
+        infile = open(input_file, 'rb')
+        infile.seek(start_offset)
+        return infile
+    infile = io.BufferedReader(ThreadedReader(open_decompressed(input_file, compression)), buffer_size)
+    remaining = start_offset
+    while remaining > 0:
+        skipped = len(infile.read(min(remaining, buffer_size)))
+        if not skipped:
+            break
+        remaining -= skipped
+    return infile
+
+################################################################
+# Streaming pipeline stages
+################################################################
+
+# Records passed between pipeline stages are (offset, sentence, tally):
+# offset is the input byte offset just past the line the sentence came from,
+# sentence is None for a record that only carries counts, and tally is None
+# or a {filter_name: count} dict of the lines rejected since the previous
+# record. Counts travel in order with the sentences, so whenever a sentence
+# is written, the counts seen so far cover exactly the input up to its offset.
+# Stages pass count-only records on instead of merging them into the next
+# sentence, so the counts of each input file stay with that file (see
+# read_input_files).
+
+def read_sentences(input_file: str, start_offset: int = 0, end_offset=None):
+    """
+    Yield (offset, sentence) for the sentence column of each usable TSV
+    line, one line at a time, so the whole corpus never has to be held in
+    memory. offset is the byte offset just past the line, which is where
+    reading resumes after it. Reading starts at start_offset (which must be
+    the start of a line) and stops at end_offset, if given.
+    """
+    with open_input(input_file, start_offset) as infile:
+        yield from split_sentences(infile, start_offset, end_offset)
+
+def split_sentences(raw_lines, start_offset: int = 0, end_offset=None):
+    """
+    Yield (offset, sentence) like read_sentences for an iterable of raw
+    (bytes) lines, the first of which starts at start_offset.
+    """
+    offset = start_offset
+    for raw_line in raw_lines:
+        if end_offset is not None and offset >= end_offset:
+            break
+        line_start = offset
+        offset += len(raw_line)
+        if b'\r' in raw_line:
+            lines = split_carriage_returns(raw_line, line_start)
+        else:
+            lines = ((raw_line, offset),)
+        for line, line_end in lines:
+            line = line.decode('utf-8').strip()
+            if not line:
+                continue
+
+            parts = line.split('\t')
+            if len(parts) < 2:
+                continue
+
+            # We ignore the first column (ID) for final output,
+            # only use the second column (sentence).
+            yield line_end, parts[1].strip()
+
+def split_carriage_returns(raw_line: bytes, line_start: int):
+    """
+    Split a raw line at lone '\r's, as text-mode reading does, into
+    (line, offset) pairs, where offset is the byte offset just past each
+    part (and its '\r'), so reading can resume between the parts. A '\r'
+    is never part of a multi-byte UTF-8 character, so the parts can be
+    decoded separately.
+    """
+    lines = []
+    start = 0
+    while start < len(raw_line):
+        end = raw_line.find(b'\r', start) + 1
+        if end == 0:
+            end = len(raw_line)
+        elif raw_line[end : end + 1] == b'\n':
+            end += 1
+        lines.append((raw_line[start:end], line_start + end))
+        start = end
+    return lines
+
+def merge_tally(carry, tally):
+    """Add the counts in tally to carry; either may be None."""
+    if not tally:
+        return carry
+    if carry is None:
+        return tally
+    for filter_name, count in tally.items():
+        carry[filter_name] = carry.get(filter_name, 0) + count
+    return carry
+
+def apply_fast_filters(lines, first_failing_filter):
+    """
+    First pipeline stage: turn (offset, sentence) lines into records for the
+    sentences that pass every fast filter. first_failing_filter maps a
+    sentence to the name of the first filter it fails (or None), and each
+    rejected sentence is counted against that filter. A line without a
+    sentence (the end of an input file) becomes a count-only record.
+    """
+    tally = None
+    offset = None
+    for offset, sentence in lines:
+        if sentence is None:
+            yield offset, None, tally
+            tally = None
+            continue
+        filter_name = first_failing_filter(sentence)
+        if filter_name is None:
+            yield offset, sentence, tally
+            tally = None
+        else:
+            if tally is None:
+                tally = {}
+            tally[filter_name] = tally.get(filter_name, 0) + 1
+    if tally:
+        yield offset, None, tally
+
+def apply_columnar_fast_filters(blocks, columnar_filter):
+    """
+    Columnar counterpart of apply_fast_filters: turn the (offsets, sentences)
+    blocks of read_sentence_columns into records, classifying each block at
+    once with a columnar filter (see create_columnar_fast_filters). An
+    (offset, None) block (the end of an input file) becomes a count-only
+    record.
+    """
+    filter_names = [None] + [filter_name for _, filter_name in FAST_FILTERS]
+    tally = None
+    offset = None
+    for offsets, sentences in blocks:
+        if sentences is None:
+            offset = offsets
+            yield offset, None, tally
+            tally = None
+            continue
+        codes = columnar_filter(sentences)
+        accepted = iter(sentences.filter(codes == 0).to_pylist())
+        for offset, code in zip(offsets.tolist(), codes.tolist()):
+            if code == 0:
+                yield offset, next(accepted), tally
+                tally = None
+            else:
+                filter_name = filter_names[code]
+                if tally is None:
+                    tally = {}
+                tally[filter_name] = tally.get(filter_name, 0) + 1
+    if tally:
+        yield offset, None, tally
+
+def read_fast_filtered(input_files, fast_engine: str, first_failing_filter, start_offset: int = 0, end_offset=None,
+                       input_column=None, shard=None, file_ranges=None):
+    """
+    Read input_files (see read_input_files) from start_offset to end_offset
+    through the fast filter engine built by create_fast_filter_engine,
+    without progress reporting.
+    """
+    blocks = read_input_files(input_files, start_offset, end_offset, input_column, columns=fast_engine == 'columnar',
+                              shard=shard, file_ranges=file_ranges)
+    if fast_engine == 'columnar':
+        return apply_columnar_fast_filters(blocks, first_failing_filter)
+    return apply_fast_filters(blocks, first_failing_filter)
+
+def apply_batched_filter(records, batch_filter_func, filter_name):
+    """
+    Pipeline stage that runs a batched slow filter, i.e. one that maps an
+    iterable of sentences to (sentence, accepted) pairs, and drops the
+    sentences it rejects.
+    """
+    pending = deque()
+
+    def sentences():
+        for record in records:
+            pending.append(record)
+            if record[1] is not None:
+                yield record[1]
+
+    carry = None
+    offset = None
+    for sentence, accepted in batch_filter_func(sentences()):
+        while True:
+            offset, queued, tally = pending.popleft()
+            carry = merge_tally(carry, tally)
+            if queued is not None:
+                break
+            yield offset, None, carry
+            carry = None
+        if accepted:
+            yield offset, sentence, carry
+            carry = None
+        else:
+            carry = merge_tally(carry, {filter_name: 1})
+    while pending:
+        offset, _, tally = pending.popleft()
+        yield offset, None, merge_tally(carry, tally)
+        carry = None
+    if carry:
+        yield offset, None, carry
+
+class StageQueue:
+    """
+    Runs a pipeline stage (any iterable) in a background thread and hands
+    its items to the consuming thread in batches of batch_size, through a
+    queue of at most maxsize batches. The stage blocks while the queue is
+    full, so memory stays bounded and a slow consumer slows the stage down.
+
+    The queue depth is sampled whenever the consumer takes a batch, and the
+    times the producer found the queue full or the consumer found it empty
+    are counted: a queue that is mostly full points at a slow consumer, one
+    that is mostly empty at a slow producer.
+
+    cProfile only sees the thread it is enabled in, so if profiles is a
+    list, the stage thread runs under its own cProfile.Profile and appends
+    it to profiles when it ends.
+    """
+    def __init__(self, name: str, iterable, maxsize: int = 8, batch_size: int = 256, profiles=None):
+        self.name = name
+        self.profiles = profiles
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self._iterable = iterable
+        self._queue = queue.Queue(maxsize)
+        self._stop = threading.Event()
+        self.puts = 0
+        self.full_waits = 0
+        self.gets = 0
+        self.empty_waits = 0
+        self.depth_total = 0
+        self.max_depth = 0
+
+    def _produce(self):
+        profile = None
+        if self.profiles is not None:
+            profile = cProfile.Profile()
+            profile.enable()
+        iterator = iter(self._iterable)
+        try:
+            batch = []
+            for item in iterator:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    if not self._put(batch):
+                        return
+                    batch = []
+            if batch and not self._put(batch):
+                return
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+        finally:
+            # Let the upstream stages shut down too
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            if profile is not None:
+                profile.disable()
+                self.profiles.append(profile)
+
+    def _put(self, item) -> bool:
+        self.puts += 1
+        if self._queue.full():
+            self.full_waits += 1
+        # Give up once the consumer is gone, instead of blocking forever
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._produce, name=f"{self.name} stage", daemon=True)
+        thread.start()
+        try:
+            while True:
+                depth = self._queue.qsize()
+                self.gets += 1
+                self.depth_total += depth
+                self.max_depth = max(self.max_depth, depth)
+                if depth == 0:
+                    self.empty_waits += 1
+                item = self._queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield from item
+        finally:
+            self._stop.set()
+            thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "max_batches": self.maxsize,
+            "batch_size": self.batch_size,
+            "mean_depth": self.depth_total / self.gets if self.gets else 0.0,
+            "max_depth": self.max_depth,
+            "full_percent": self.full_waits / self.puts * 100 if self.puts else 0.0,
+            "empty_percent": self.empty_waits / self.gets * 100 if self.gets else 0.0,
+        }
+
+################################################################
+# Parquet and Arrow IPC input
+################################################################
+
+# Input formats by file extension. Records read from Parquet and Arrow
+# files use the row number just past the row as their offset.
+INPUT_FORMATS = {
+    '.tsv': 'tsv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+}
+
+def input_format(input_file: str):
+    """
+    Return 'tsv', 'parquet' or 'arrow' for input_file, or None if
+    unsupported. Only TSV input can be compressed (e.g. corpus.tsv.gz).
+    """
+    root, extension = os.path.splitext(input_file.lower())
+    if extension in COMPRESSION_EXTENSIONS:
+        return 'tsv' if os.path.splitext(root)[1] == '.tsv' else None
+    return INPUT_FORMATS.get(extension)
+
+def _open_arrow_reader(input_file: str):
+    """Open an Arrow IPC file (random access) or, failing that, an IPC stream."""
+    import pyarrow as pa
+    source = pa.memory_map(input_file)
+    try:
+        return pa.ipc.open_file(source)
+    except pa.ArrowInvalid:
+        source.seek(0)
+        return pa.ipc.open_stream(source)
+
+def table_input_schema(input_file: str):
+    """Return the Arrow schema of a Parquet or Arrow IPC input file."""
+    import pyarrow.parquet as pq
+    if input_format(input_file) == 'parquet':
+        return pq.read_schema(input_file)
+    return _open_arrow_reader(input_file).schema
+
+def table_sentence_column(input_file: str, input_column=None) -> str:
+    """
+    Return the name of the sentence column of a Parquet or Arrow input:
+    input_column, or like the TSV input the second column. Raises
+    ValueError if it does not exist.
+    """
+    names = table_input_schema(input_file).names
+    if input_column is None:
+        if len(names) < 2:
+            raise ValueError(f"'{input_file}' has fewer than two columns; name the sentence column with --input_column")
+        return names[1]
+    if input_column not in names:
+        raise ValueError(f"'{input_file}' has no column '{input_column}' (columns: {', '.join(names)})")
+    return input_column
+
+def table_row_groups(input_file: str):
+    """
+    Return the (start, end) row ranges of the row groups of a Parquet file
+    or the record batches of an Arrow IPC file (an IPC stream counts as a
+    single range).
+    """
+    import pyarrow.parquet as pq
+    if input_format(input_file) == 'parquet':
+        metadata = pq.ParquetFile(input_file).metadata
+        sizes = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+    else:
+        reader = _open_arrow_reader(input_file)
+        if not hasattr(reader, 'num_record_batches'):
+            return [(0, reader.read_all().num_rows)]
+        sizes = [reader.get_batch(i).num_rows for i in range(reader.num_record_batches)]
+    ranges = []
+    start = 0
+    for size in sizes:
+        ranges.append((start, start + size))
+        start += size
+    return ranges
+
+def read_table_columns(input_file: str, input_column=None, start_row: int = 0, end_row=None,
+                       batch_size: int = 65536, progress=None):
+    """
+    Columnar reader for Parquet and Arrow IPC input, like
+    read_sentence_columns: yield (offsets, sentences) per record batch for
+    the rows from start_row up to end_row. Only the sentence column is read,
+    one row group (or record batch) at a time. Null sentences are skipped
+    and the rest are stripped like the TSV sentence column. Sentences that
+    still contain a tab or a line break are skipped too: no TSV line can
+    hold them, and written to TSV output they would break its rows.
+    progress, if given, is called with the number of rows of each batch.
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    column = table_sentence_column(input_file, input_column)
+    whitespace = _python_whitespace()
+
+    def batches():
+        # (first row, record batch) for every row group overlapping the range
+        if input_format(input_file) == 'parquet':
+            parquet_file = pq.ParquetFile(input_file, memory_map=True)
+            row = 0
+            for group, (group_start, group_end) in enumerate(table_row_groups(input_file)):
+                if group_end <= start_row:
+                    row = group_end
+                    continue
+                if end_row is not None and group_start >= end_row:
+                    return
+                for batch in parquet_file.iter_batches(batch_size, row_groups=[group], columns=[column]):
+                    yield row, batch
+                    row += batch.num_rows
+        else:
+            reader = _open_arrow_reader(input_file)
+            record_batches = reader
+            if hasattr(reader, 'num_record_batches'):
+                record_batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            row = 0
+            for batch in record_batches:
+                if row + batch.num_rows > start_row:
+                    yield row, batch.select([column])
+                row += batch.num_rows
+                if end_row is not None and row >= end_row:
+                    return
+
+    for row, batch in batches():
+        first = max(start_row - row, 0)
+        last = batch.num_rows if end_row is None else min(end_row - row, batch.num_rows)
+        if last <= first:
+            continue
+        values = batch.column(0).slice(first, last - first).cast(pa.string())
+        if progress is not None:
+            progress(last - first)
+        valid = values.is_valid().to_numpy(zero_copy_only=False)
+        offsets = np.arange(row + first + 1, row + last + 1, dtype=np.int64)[valid]
+        sentences = pc.utf8_trim(values.filter(valid), characters=whitespace)
+        usable = ~pc.match_substring_regex(sentences, '[\t\n\r]').to_numpy(zero_copy_only=False)
+        yield offsets[usable], sentences.filter(usable)
+
+def read_input(input_file: str, start_offset: int = 0, end_offset=None, input_column=None):
+    """Yield (offset, sentence) from a TSV, Parquet or Arrow IPC input file."""
+    if input_format(input_file) == 'tsv':
+        yield from read_sentences(input_file, start_offset, end_offset)
+        return
+    for offsets, sentences in read_table_columns(input_file, input_column, start_offset, end_offset):
+        yield from zip(offsets.tolist(), sentences.to_pylist())
+
+def read_input_columns(input_file: str, start_offset: int = 0, end_offset=None, input_column=None, progress=None):
+    """Yield (offsets, sentences) blocks from a TSV, Parquet or Arrow IPC input file."""
+    if input_format(input_file) == 'tsv':
+        return read_sentence_columns(input_file, start_offset, end_offset, progress=progress)
+    return read_table_columns(input_file, input_column, start_offset, end_offset, progress=progress)
+
+def input_size(input_file: str):
+    """
+    Return the size of input_file in offset units (bytes or rows), or None
+    if unknown (compressed input), and the unit's name.
+    """
+    if input_format(input_file) == 'tsv':
+        return (None if input_compression(input_file) else os.path.getsize(input_file)), "B"
+    row_groups = table_row_groups(input_file)
+    return (row_groups[-1][1] if row_groups else 0), " rows"
+
+################################################################
+# Multiple input files
+################################################################
+
+# Several input files are read as one input: a record's offset holds the
+# index of its file in the bits above FILE_INDEX_SHIFT and the offset within
+# the file below them, so a single number still says where to resume. With
+# one input file, offsets are plain file offsets.
+FILE_INDEX_SHIFT = 48
+
+def file_offset(file_index: int, offset: int) -> int:
+    """Return the offset of position offset of input file number file_index."""
+    return (file_index << FILE_INDEX_SHIFT) + offset
+
+def split_file_offset(offset: int):
+    """Return the (file_index, offset within the file) of an offset."""
+    return offset >> FILE_INDEX_SHIFT, offset & ((1 << FILE_INDEX_SHIFT) - 1)
+
+def resolve_input_files(input_path: str):
+    """
+    Return the input files named by input_path: the file itself, every
+    file with a supported input format in a directory, or the files
+    matching a glob pattern, sorted by name.
+    """
+    if os.path.isdir(input_path):
+        return sorted(os.path.join(input_path, name) for name in os.listdir(input_path)
+                      if os.path.isfile(os.path.join(input_path, name)) and input_format(name) is not None)
+    if glob.has_magic(input_path):
+        return sorted(path for path in glob.glob(input_path) if os.path.isfile(path))
+    return [input_path]
+
+def read_input_files(input_files, start_offset: int = 0, end_offset=None, input_column=None, columns: bool = False,
+                     progress=None, shard=None, file_ranges=None):
+    """
+    Yield the (offset, sentence) lines of each of input_files in turn (see
+    read_input), or with columns=True its (offsets, sentences) blocks (see
+    read_input_columns), from start_offset to end_offset. Offsets are
+    combined with the file index (see file_offset), and each file ends with
+    an (offset, None) marker, so the counts of its rejected lines are not
+    carried into the next file. With shard=(index, count), only the lines
+    of that shard are yielded (see sentence_shard). file_ranges, if given,
+    limits each file to a (start, end) range of its offsets (end may be
+    None).
+    """
+    first_index, first_offset = split_file_offset(start_offset)
+    last_index, last_offset = (len(input_files) - 1, None) if end_offset is None else split_file_offset(end_offset)
+    for file_index in range(first_index, min(last_index + 1, len(input_files))):
+        base = file_offset(file_index, 0)
+        start, end = file_range(file_ranges, file_index,
+                                first_offset if file_index == first_index else 0,
+                                last_offset if file_index == last_index else None)
+        offset = start
+        if columns:
+            for offsets, sentences in read_input_columns(input_files[file_index], start, end, input_column, progress):
+                if len(offsets):
+                    offset = int(offsets[-1])
+                if shard is not None:
+                    offsets, sentences = select_shard_block(offsets, sentences, shard)
+                yield offsets + base, sentences
+        else:
+            for offset, sentence in read_input(input_files[file_index], start, end, input_column):
+                if shard is None or sentence_shard(sentence, shard[1]) == shard[0]:
+                    yield offset + base, sentence
+        yield offset + base, None
+
+def file_range(file_ranges, file_index: int, start: int = 0, end=None):
+    """
+    Narrow the offset range (start, end) of input file number file_index to
+    its entry in file_ranges (see read_input_files). None means no limit.
+    """
+    if file_ranges is None:
+        return start, end
+    range_start, range_end = file_ranges[file_index]
+    if range_end is not None:
+        end = range_end if end is None else min(end, range_end)
+    return max(start, range_start), end
+
+def input_files_size(input_files, file_ranges=None):
+    """
+    Return the total size of input_files in offset units, or None if any
+    size is unknown (see input_size), and the unit's name. With file_ranges,
+    a file's size is the end of its range, if given.
+    """
+    sizes = [input_size(input_file) for input_file in input_files]
+    ends = [file_range(file_ranges, file_index, 0, size)[1] for file_index, (size, _) in enumerate(sizes)]
+    if any(end is None for end in ends):
+        return None, sizes[0][1]
+    return sum(ends), sizes[0][1]
+
+################################################################
+# Sharding
+################################################################
+
+# Left in the output folder of a completed --shard run, for merge_shards.py
+SHARD_FILENAME = "shard.json"
+
+def parse_shard(value: str):
+    """Parse an --shard argument 'i/N' (0 <= i < N) into (i, N)."""
+    match = re.fullmatch(r"(\d+)/(\d+)", value)
+    if match is None or not int(match.group(1)) < int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"expected i/N with 0 <= i < N, got '{value}'")
+    return int(match.group(1)), int(match.group(2))
+
+def sentence_shard(sentence: str, shards: int) -> int:
+    """
+    Return the shard (0 to shards - 1) of a sentence. Identical sentences
+    always share a shard, so exact deduplication within each shard is
+    global. The high half of sentence_hash64 is used, since the dedup hash
+    sets index by the low bits, which must stay spread out within a shard.
+    """
+    return (sentence_hash64(sentence) >> 32) % shards
+
+def shard_inputs(input_files):
+    """
+    Describe input_files by name, size and fingerprint (see
+    file_fingerprint) rather than by path, since the machines of a sharded
+    run may mount the corpus in different places.
+    """
+    inputs = []
+    for input_file in input_files:
+        size = os.path.getsize(input_file)
+        inputs.append({"name": os.path.basename(input_file), "size": size,
+                       "fingerprint": file_fingerprint(input_file, size)})
+    return inputs
+
+def select_shard_block(offsets, sentences, shard):
+    """Keep the (offsets, sentences) of a columnar block that belong to shard=(index, count)."""
+    import numpy as np
+    import pyarrow as pa
+    index, count = shard
+    keep = np.fromiter((sentence_shard(sentence, count) == index for sentence in sentences.to_pylist()),
+                       dtype=bool, count=len(sentences))
+    return offsets[keep], sentences.filter(pa.array(keep))
+
+################################################################
+# Parallel fast filtering
+################################################################
+
+def split_byte_ranges(input_file: str, start_offset: int = 0, range_size: int = 8 << 20):
+    """
+    Split input_file, from start_offset on, into (start, end) byte ranges of
+    roughly range_size bytes. The file is memory-mapped to find the line
+    ends, so every range starts at the beginning of a line.
+    """
+    ranges = []
+    with open(input_file, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        if start_offset >= size:
+            return ranges
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = start_offset
+            while start < size:
+                newline = mm.find(b'\n', min(start + range_size, size) - 1)
+                end = size if newline == -1 else newline + 1
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+def split_input_ranges(input_file: str, start_offset: int = 0, range_size: int = 8 << 20):
+    """
+    Split input_file from start_offset on into ranges for the fast filter
+    workers: newline-aligned byte ranges for TSV input, row groups (or
+    record batches) for Parquet and Arrow input. Compressed TSV input
+    cannot be split, so it is a single range with an open end (None).
+    """
+    if input_compression(input_file) is not None:
+        return [(start_offset, None)]
+    if input_format(input_file) == 'tsv':
+        return split_byte_ranges(input_file, start_offset, range_size)
+    return [(max(start, start_offset), end) for start, end in table_row_groups(input_file) if end > start_offset]
+
+# Per-process state, set up once by _init_fast_worker in each pool worker.
+_worker_fast_engine = None
+_worker_fast_filter = None
+_worker_input_column = None
+_worker_shard = None
+
+def _init_fast_worker(fast_engine: str, adaptive_sample_size: int, input_column=None, shard=None):
+    global _worker_fast_engine, _worker_fast_filter, _worker_input_column, _worker_shard
+    _worker_fast_engine = fast_engine
+    _worker_fast_filter = create_fast_filter_engine(fast_engine, FAST_FILTERS, adaptive_sample_size)
+    _worker_input_column = input_column
+    _worker_shard = shard
+
+def _fast_filter_range(input_file: str, start: int, end: int):
+    return list(read_fast_filtered([input_file], _worker_fast_engine, _worker_fast_filter, start, end,
+                                   _worker_input_column, _worker_shard))
+
+def parallel_fast_filter_records(input_files, workers: int, fast_engine: str = 'fused',
+                                 start_offset: int = 0, range_size: int = 8 << 20,
+                                 adaptive_sample_size: int = 10000, progress=None, input_column=None, shard=None,
+                                 file_ranges=None, context=None):
+    """
+    Parallel version of apply_fast_filters(read_input_files(...)): each
+    input file is split into ranges (see split_input_ranges) that a process
+    pool filters independently, so ranges of several files are filtered at
+    the same time. A compressed file is filtered whole by one worker, so a
+    directory of compressed files is filtered a file per worker. Each range's records, with their rejection tallies, are
+    yielded in input order, so the counts merge exactly as in a serial run.
+    At most workers + 2 ranges are in flight, so the finished results
+    waiting in the parent (for example while spaCy is the bottleneck) take
+    about two ranges' worth of memory beyond the ranges being filtered.
+    progress, if given, is called with the size of each finished range (in
+    bytes or rows). context is the multiprocessing context the pool is
+    created with (see pool_context).
+    """
+    context = context or multiprocessing.get_context()
+    first_index, first_offset = split_file_offset(start_offset)
+    ranges = []
+    for file_index in range(first_index, len(input_files)):
+        first, last = file_range(file_ranges, file_index, first_offset if file_index == first_index else 0)
+        ranges.extend((file_index, start, end if last is None or end is None else min(end, last))
+                      for start, end in split_input_ranges(input_files[file_index], first, range_size)
+                      if last is None or start < last)
+    max_pending = workers + 2
+    pending = deque()
+
+    def finish_oldest():
+        (file_index, start, end), result = pending.popleft()
+        base = file_offset(file_index, 0)
+        records = result.get()
+        del result
+        for offset, sentence, tally in records:
+            yield offset + base, sentence, tally
+        # A compressed file's range ends where its last line does
+        if end is None:
+            end = records[-1][0] if records else start
+        del records
+        # Close the file after its last range (see read_input_files)
+        if not pending or pending[0][0][0] != file_index:
+            yield end + base, None, None
+        if progress is not None:
+            progress(end - start)
+
+    with context.Pool(workers, initializer=_init_fast_worker,
+                      initargs=(fast_engine, adaptive_sample_size, input_column, shard)) as pool:
+        for file_index, start, end in ranges:
+            pending.append(((file_index, start, end),
+                            pool.apply_async(_fast_filter_range, (input_files[file_index], start, end))))
+            if len(pending) >= max_pending:
+                yield from finish_oldest()
+        while pending:
+            yield from finish_oldest()
+
+################################################################
+# Checkpoints
+################################################################
+
+CHECKPOINT_FILENAME = ".checkpoint.json"
+
+def save_checkpoint(output_folder: str, checkpoint: dict):
+    """Atomically replace the checkpoint file in output_folder."""
+    path = os.path.join(output_folder, CHECKPOINT_FILENAME)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as outfile:
+        json.dump(checkpoint, outfile, ensure_ascii=False, indent=2)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temp_path, path)
+
+def remove_checkpoint(output_folder: str):
+    path = os.path.join(output_folder, CHECKPOINT_FILENAME)
+    if os.path.exists(path):
+        os.remove(path)
+
+def load_checkpoint(output_folder: str):
+    """Return the checkpoint saved in output_folder, or None if there is none."""
+    path = os.path.join(output_folder, CHECKPOINT_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as infile:
+        return json.load(infile)
+
+################################################################
+# Incremental runs
+################################################################
+
+# State of --incremental runs, kept in the output folder
+INCREMENTAL_FILENAME = "incremental.json"
+# Options that must stay the same in every run on an incremental output folder
+INCREMENTAL_OPTIONS = ["single_sentences", "output_format", "compress_output", "dedup"]
+# Bytes hashed at the start and before the processed end of a file, to check
+# that it was not rewritten
+FINGERPRINT_BYTES = 1 << 16
+
+def file_fingerprint(path: str, end: int) -> str:
+    """Hash of the first and the last FINGERPRINT_BYTES bytes of path before byte end."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as infile:
+        digest.update(infile.read(min(end, FINGERPRINT_BYTES)))
+        start = max(0, end - FINGERPRINT_BYTES)
+        infile.seek(start)
+        digest.update(infile.read(end - start))
+    return digest.hexdigest()
+
+def load_incremental_state(output_folder: str):
+    path = os.path.join(output_folder, INCREMENTAL_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as infile:
+        return json.load(infile)
+
+def complete_lines_end(path: str, size: int, block_size: int = 1 << 16) -> int:
+    """
+    Return the offset just past the last '\n' at or before byte size of
+    path (0 if there is none): the end of the complete lines, leaving out
+    a last line that may still be being written.
+    """
+    with open(path, 'rb') as infile:
+        end = size
+        while end > 0:
+            start = max(0, end - block_size)
+            infile.seek(start)
+            newline = infile.read(end - start).rfind(b'\n')
+            if newline != -1:
+                return start + newline + 1
+            end = start
+    return 0
+
+def plan_incremental_run(input_files, state):
+    """
+    Compare input_files with the files an earlier --incremental run
+    recorded in state (or None). Returns the files that need processing,
+    the (start, end) offset range of each (see read_input_files), the
+    fingerprint to record for each, and the number of unchanged files.
+    Uncompressed TSV files that grew are read from where the last run
+    stopped, and only up to the end of their last complete line, so a line
+    still being appended is left for the next run. Raises ValueError for a
+    file that changed in any other way.
+    """
+    files, file_ranges, fingerprints = [], [], []
+    unchanged = 0
+    for input_file in input_files:
+        size = os.path.getsize(input_file)
+        appendable = input_format(input_file) == 'tsv' and input_compression(input_file) is None
+        if appendable:
+            size = complete_lines_end(input_file, size)
+        record = state["files"].get(os.path.abspath(input_file)) if state is not None else None
+        if record is None:
+            start = 0
+        elif record["size"] == size and record["fingerprint"] == file_fingerprint(input_file, size):
+            unchanged += 1
+            continue
+        elif appendable and size > record["size"] and record["fingerprint"] == file_fingerprint(input_file, record["size"]):
+            start = record["size"]
+        else:
+            raise ValueError(f"'{input_file}' changed since it was processed. Only data appended to uncompressed "
+                             f"TSV files can be processed incrementally.")
+        files.append(input_file)
+        # Files are read up to the size planned here, in case they grow meanwhile
+        file_ranges.append((start, size if appendable else None))
+        fingerprints.append({"size": size, "fingerprint": file_fingerprint(input_file, size)})
+    return files, file_ranges, fingerprints, unchanged
+
+def save_incremental_state(output_folder: str, state: dict, deduplicator=None):
+    """
+    Replace the incremental state in output_folder. The deduplicator's hash
+    sets go to a numbered binary file named in the state, which is written
+    first, so the state never points at a partly written file.
+    """
+    previous = load_incremental_state(output_folder)
+    run = previous["run"] + 1 if previous is not None else 1
+    state = dict(state, run=run, hash_file=None, hash_sets=[])
+    if deduplicator is not None:
+        state["hash_file"] = f"incremental_hashes_{run}.bin"
+        with open(os.path.join(output_folder, state["hash_file"]), 'wb') as outfile:
+            for hash_set in deduplicator.hash_sets():
+                hash_set.dump(outfile)
+                state["hash_sets"].append([len(hash_set.table), hash_set.count])
+            outfile.flush()
+            os.fsync(outfile.fileno())
+    replace_file(os.path.join(output_folder, INCREMENTAL_FILENAME), json.dumps(state, ensure_ascii=False, indent=2))
+    remove_incremental_hashes(output_folder, previous)
+
+def load_incremental_hashes(output_folder: str, state: dict, deduplicator):
+    """Restore the deduplicator's hash sets saved with state."""
+    with open(os.path.join(output_folder, state["hash_file"]), 'rb') as infile:
+        for hash_set, (size, count) in zip(deduplicator.hash_sets(), state["hash_sets"]):
+            hash_set.load(infile, size, count)
+
+def remove_incremental_hashes(output_folder: str, state):
+    if state is not None and state.get("hash_file"):
+        path = os.path.join(output_folder, state["hash_file"])
+        if os.path.exists(path):
+            os.remove(path)
+
+################################################################
+# Profiling
+################################################################
+
+PROFILE_FILENAME = "profile.json"
+
+class PipelineProfiler:
+    """
+    Collects wall time, CPU time, call counts and traced memory for the
+    pipeline stages and for individual filter functions.
+
+    Stages are wrapped iterators, chained in the order they are added; each
+    stage's time includes the upstream stages it pulls from, so the report
+    subtracts the previous stage to get the time spent in the stage itself.
+    With trace_memory, tracemalloc is sampled after every call, so the
+    per-stage figure is the largest traced allocation seen at that stage's
+    boundary. Tracing slows the run down several times, so it is optional.
+    """
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.functions = {}
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        if trace_memory:
+            tracemalloc.start()
+
+    @staticmethod
+    def _new_stats():
+        return {"wall_seconds": 0.0, "cpu_seconds": 0.0, "calls": 0, "peak_traced_bytes": 0}
+
+    def _record(self, stats, wall, cpu):
+        stats["wall_seconds"] += time.perf_counter() - wall
+        stats["cpu_seconds"] += time.process_time() - cpu
+        stats["calls"] += 1
+        if self.trace_memory:
+            stats["peak_traced_bytes"] = max(stats["peak_traced_bytes"], tracemalloc.get_traced_memory()[0])
+
+    def stage(self, name: str, iterable):
+        """Wrap a pipeline stage (an iterable) so every next() is measured."""
+        stats = self.stages[name] = self._new_stats()
+
+        def profiled_stage():
+            iterator = iter(iterable)
+            while True:
+                wall = time.perf_counter()
+                cpu = time.process_time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    self._record(stats, wall, cpu)
+                    stats["calls"] -= 1
+                    return
+                self._record(stats, wall, cpu)
+                yield item
+        return profiled_stage()
+
+    def function(self, name: str, func, batched: bool = False):
+        """
+        Wrap a function (e.g. a filter) so every call is measured. A batched
+        function takes a batch of lines as its first argument, and its
+        lines/s are counted per line rather than per call.
+        """
+        stats = self.functions[name] = self._new_stats()
+        if batched:
+            stats["lines"] = 0
+
+        def profiled_function(*args, **kwargs):
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            result = func(*args, **kwargs)
+            self._record(stats, wall, cpu)
+            if batched:
+                stats["lines"] += len(args[0])
+            return result
+        return profiled_function
+
+    def report(self, total_lines: int) -> dict:
+        def finish(stats, lines):
+            result = dict(stats)
+            peak = result.pop("peak_traced_bytes")
+            result["peak_traced_mb"] = peak / 1e6 if self.trace_memory else None
+            result["lines_per_second"] = lines / stats["wall_seconds"] if stats["wall_seconds"] else None
+            return result
+
+        stages = {}
+        upstream = None
+        for name, stats in self.stages.items():
+            own = dict(stats)
+            if upstream is not None:
+                own["wall_seconds"] -= upstream["wall_seconds"]
+                own["cpu_seconds"] -= upstream["cpu_seconds"]
+            upstream = stats
+            stages[name] = finish(own, total_lines)
+        functions = {name: finish(stats, stats.get("lines", stats["calls"])) for name, stats in self.functions.items()}
+        try:
+            import resource
+            peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        except ImportError:
+            # The resource module is Unix-only
+            peak_rss_mb = None
+
+        report = {
+            "total_lines": total_lines,
+            "wall_seconds": time.perf_counter() - self.start_wall,
+            "cpu_seconds": time.process_time() - self.start_cpu,
+            "peak_rss_mb": peak_rss_mb,
+            "stages": stages,
+            "filters": functions,
+        }
+        if self.trace_memory:
+            report["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+        return report
+
+def print_profile_report(report: dict):
+    print("\n===== Profile =====")
+    print(f"{'stage / filter':32s} {'wall s':>10s} {'cpu s':>10s} {'calls':>12s} {'lines/s':>14s} {'mem MB':>8s}")
+    for section in ("stages", "filters"):
+        for name, stats in report[section].items():
+            lines_per_second = stats["lines_per_second"]
+            memory = stats["peak_traced_mb"]
+            print(f"{name:32s} {stats['wall_seconds']:10.2f} {stats['cpu_seconds']:10.2f} {stats['calls']:12d} "
+                  f"{lines_per_second if lines_per_second is not None else 0:14,.0f} "
+                  f"{f'{memory:8.1f}' if memory is not None else '       -'}")
+    line = f"Total wall time: {report['wall_seconds']:.2f} s"
+    if report["peak_rss_mb"] is not None:
+        line += f", peak RSS: {report['peak_rss_mb']:.0f} MB"
+    if "peak_traced_mb" in report:
+        line += f", peak traced: {report['peak_traced_mb']:.1f} MB"
+    print(line)
+
+################################################################
+# Run metrics
+################################################################
+
+# Prefix of the Prometheus metric names
+METRICS_PREFIX = "cv_filter"
+
+class RunMetrics:
+    """
+    Counts and throughput of a run, for --metrics_json and the Prometheus
+    textfile of --metrics_prom. filter_fail_count is the live dict updated
+    by main(). Counts cover the whole run, including the part done before a
+    --resume; rates cover only the current process.
+    """
+    def __init__(self, input_file: str, filter_fail_count: dict, start_position: int, total_written: int,
+                 input_unit: str = "bytes"):
+        self.input_file = input_file
+        self.filter_fail_count = filter_fail_count
+        self.start_position = start_position
+        self.start_lines = sum(filter_fail_count.values()) + total_written
+        self.input_unit = input_unit
+        self.start_wall = time.perf_counter()
+
+    def snapshot(self, input_position: int, total_written: int, chunk_count: int, finished: bool = False) -> dict:
+        """input_position is the number of input bytes (or rows) processed, over all input files."""
+        elapsed = time.perf_counter() - self.start_wall
+        total_lines = sum(self.filter_fail_count.values()) + total_written
+        return {
+            "input_file": self.input_file,
+            "finished": finished,
+            "elapsed_seconds": elapsed,
+            "total_lines": total_lines,
+            "final_lines": total_written,
+            "rejected": dict(self.filter_fail_count),
+            "acceptance_rate": total_written / total_lines if total_lines else None,
+            "chunk_count": chunk_count,
+            "input_unit": self.input_unit,
+            "input_position": input_position,
+            "lines_per_second": (total_lines - self.start_lines) / elapsed if elapsed else None,
+            f"input_{self.input_unit}_per_second": (input_position - self.start_position) / elapsed if elapsed else None,
+        }
+
+def format_prometheus_metrics(metrics: dict) -> str:
+    """Render a RunMetrics snapshot in the Prometheus text exposition format."""
+    input_label = metrics["input_file"].replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    unit = metrics["input_unit"]
+    lines = []
+
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} {metric_type}")
+        for labels, value in samples:
+            label_text = ",".join([f'input="{input_label}"'] + [f'{key}="{val}"' for key, val in labels.items()])
+            lines.append(f"{METRICS_PREFIX}_{name}{{{label_text}}} {value if value is not None else 'NaN'}")
+
+    metric("lines_total", "counter", "Input lines processed.", [({}, metrics["total_lines"])])
+    metric("rejected_lines_total", "counter", "Input lines rejected, by the first filter they failed.",
+           [({"filter": filter_name}, count) for filter_name, count in metrics["rejected"].items()])
+    metric("accepted_lines_total", "counter", "Sentences written to the output.", [({}, metrics["final_lines"])])
+    metric("acceptance_ratio", "gauge", "Share of the processed lines that were accepted.",
+           [({}, metrics["acceptance_rate"])])
+    metric("chunks", "gauge", "Output chunks completed.", [({}, metrics["chunk_count"])])
+    metric(f"input_position_{unit}", "gauge", f"Input {unit} processed.", [({}, metrics["input_position"])])
+    metric("elapsed_seconds", "gauge", "Seconds since the current process started filtering.", [({}, metrics["elapsed_seconds"])])
+    metric("lines_per_second", "gauge", "Input lines processed per second by the current process.",
+           [({}, metrics["lines_per_second"])])
+    metric(f"input_{unit}_per_second", "gauge", f"Input {unit} processed per second by the current process.",
+           [({}, metrics[f"input_{unit}_per_second"])])
+    metric("finished", "gauge", "1 once the run has completed.", [({}, int(metrics["finished"]))])
+    return "\n".join(lines) + "\n"
+
+def replace_file(path: str, text: str):
+    """Write text to path through a temporary file, so readers never see a partial file."""
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as outfile:
+        outfile.write(text)
+    os.replace(temp_path, path)
+
+################################################################
+# Output
+################################################################
+
+# Metadata for final output lines
+SOURCE = "https://www.nb.no/sprakbanken/ressurskatalog/oai-nb-no-sbr-80/"
+ADDITIONAL_RATIONALE = (
+    "This is a CC0 licensed corpus cleared from newspaper text. "
+    "The source sentences from a translation corpus is used.  "
+    "It is released by Språkbanken."
+)
+DOMAIN = "General"
+
+# Column names for Parquet and Arrow output, in the order of the TSV columns
+OUTPUT_COLUMNS = [
+    "sentence",
+    "source",
+    "additional_rationale_open_license",
+    "sentence_quality_assurance_feedback",
+    "domain",
+]
+
+def format_output_line(sentence: str, single_sentences: bool = False) -> str:
+    if single_sentences:
+        return f"{sentence}\n"
+    return (
+        f"{sentence}\t"
+        f"{SOURCE}\t"
+        f"{ADDITIONAL_RATIONALE}\t"
+        f""  # Sentence Quality Assurance Feedback: blank
+        f"\t"
+        f"{DOMAIN}\n"
+    )
+
+class ChunkWriter:
+    """
+    Write accepted sentences to output_1.tsv, output_2.tsv, ... in the
+    output folder, starting a new file every chunk_size sentences. With
+    compression ('gzip', 'zstd' or 'xz') the chunks are compressed, e.g.
+    output_1.tsv.gz.
+
+    Each chunk is written to a hidden temporary file and renamed into place
+    once it is complete, so an output_N.tsv file is never partially written.
+    If the run fails, the unfinished chunk is discarded and every chunk
+    already renamed is kept.
+    """
+    def __init__(self, output_folder: str, chunk_size: int, single_sentences: bool = False,
+                 buffer_size: int = 1 << 20, chunk_count: int = 0, total_written: int = 0,
+                 on_commit=None, compression=None):
+        self.output_folder = output_folder
+        self.chunk_size = chunk_size
+        self.single_sentences = single_sentences
+        self.buffer_size = buffer_size
+        # Number of chunks and sentences already written (non-zero when resuming)
+        self.chunk_count = chunk_count
+        self.total_written = total_written
+        # Called with the writer after each chunk has been moved into place
+        self.on_commit = on_commit
+        self.compression = compression
+        if compression is not None:
+            suffix = {name: extension for extension, name in COMPRESSION_EXTENSIONS.items()}[compression]
+            self.extension = f"tsv{suffix}"
+        self._file = None
+        # The underlying binary file when the text goes through a compressor
+        self._raw = None
+        self._lines_in_chunk = 0
+
+    extension = "tsv"
+
+    def chunk_path(self, chunk_number: int) -> str:
+        return os.path.join(self.output_folder, f"output_{chunk_number}.{self.extension}")
+
+    def _temp_path(self, chunk_number: int) -> str:
+        return os.path.join(self.output_folder, f".output_{chunk_number}.{self.extension}.tmp")
+
+    def write(self, sentence: str):
+        self._append(sentence)
+        self._lines_in_chunk += 1
+        self.total_written += 1
+        if self._lines_in_chunk == self.chunk_size:
+            self.commit_chunk()
+
+    def _append(self, sentence: str):
+        if self._file is None:
+            temp_path = self._temp_path(self.chunk_count + 1)
+            if self.compression is None:
+                self._file = open(temp_path, 'w', encoding='utf-8', buffering=self.buffer_size)
+            else:
+                self._raw = open(temp_path, 'wb', buffering=self.buffer_size)
+                self._file = io.TextIOWrapper(open_compressor(self._raw, self.compression), encoding='utf-8')
+        self._file.write(format_output_line(sentence, self.single_sentences))
+
+    def _finish_temp(self):
+        """Write out the current chunk's temporary file and sync it to disk."""
+        if self._raw is None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        else:
+            # Closing the text stream finishes the compressed data
+            self._file.close()
+            self._raw.flush()
+            os.fsync(self._raw.fileno())
+            self._raw.close()
+            self._raw = None
+        self._file = None
+
+    def _drop_temp(self):
+        self._file.close()
+        self._file = None
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+        os.remove(self._temp_path(self.chunk_count + 1))
+
+    def commit_chunk(self):
+        """Finish the current chunk and atomically move it into place."""
+        if self._lines_in_chunk == 0:
+            return
+        self._finish_temp()
+        self.chunk_count += 1
+        os.replace(self._temp_path(self.chunk_count), self.chunk_path(self.chunk_count))
+        self._lines_in_chunk = 0
+        if self.on_commit is not None:
+            self.on_commit(self)
+
+    def discard_chunk(self):
+        """Drop the unfinished chunk, e.g. after an error."""
+        if self._lines_in_chunk == 0:
+            return
+        self._drop_temp()
+        self.total_written -= self._lines_in_chunk
+        self._lines_in_chunk = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit_chunk()
+        else:
+            self.discard_chunk()
+        return False
+
+class TableChunkWriter(ChunkWriter):
+    """
+    ChunkWriter for Parquet (output_N.parquet) or Arrow IPC
+    (output_N.arrow) chunks with the OUTPUT_COLUMNS of the TSV output, or
+    only the sentence column with single_sentences. A chunk's sentences are
+    kept in memory and written as one table when the chunk is committed.
+    Arrow IPC files can be memory-mapped by downstream tools.
+    Raises ImportError if pyarrow is not installed.
+    """
+    def __init__(self, output_folder: str, chunk_size: int, single_sentences: bool = False,
+                 output_format: str = "parquet", **kwargs):
+        import pyarrow  # Fail early if pyarrow is missing
+        super().__init__(output_folder, chunk_size, single_sentences, **kwargs)
+        self.output_format = output_format
+        self.extension = output_format
+        self._sentences = []
+
+    def _append(self, sentence: str):
+        self._sentences.append(sentence)
+
+    def _table(self):
+        import pyarrow as pa
+        sentences = pa.array(self._sentences, type=pa.string())
+        if self.single_sentences:
+            return pa.table([sentences], names=OUTPUT_COLUMNS[:1])
+        constants = [SOURCE, ADDITIONAL_RATIONALE, "", DOMAIN]
+        columns = [sentences] + [pa.repeat(pa.scalar(value), len(sentences)) for value in constants]
+        return pa.table(columns, names=OUTPUT_COLUMNS)
+
+    def _finish_temp(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = self._table()
+        with open(self._temp_path(self.chunk_count + 1), 'wb') as outfile:
+            if self.output_format == "parquet":
+                pq.write_table(table, outfile)
+            else:
+                with pa.ipc.new_file(outfile, table.schema) as writer:
+                    writer.write_table(table)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        self._sentences = []
+
+    def _drop_temp(self):
+        self._sentences = []
+
 ################################################################
 # Main logic
 ################################################################
 
 def main():
     parser = argparse.ArgumentParser(description="Filter Norwegian sentences with spaCy.")
-    parser.add_argument('--input_file', required=True, help='Input TSV file.')
-    parser.add_argument('--output_folder', required=True, help='Folder where output TSV chunks are saved.')
+    parser.add_argument('--input_file', help='Input TSV, Parquet (.parquet) or Arrow IPC (.arrow, .feather) file, a directory of such files, or a quoted glob pattern matching them. Several files are read in name order as one input.')
+    parser.add_argument('--input_column', help='Sentence column of Parquet or Arrow input. Defaults to the second column, as for TSV input.')
+    parser.add_argument('--output_folder', help='Folder where output chunks are saved.')
+    parser.add_argument('--compress_output', choices=['gzip', 'zstd', 'xz'], help='Compress each TSV output chunk (output_N.tsv.gz, .tsv.zst or .tsv.xz).')
+    parser.add_argument('--output_format', choices=['tsv', 'parquet', 'arrow'], default='tsv', help="Format of the output chunks: 'tsv', 'parquet' or 'arrow' (Arrow IPC, memory-mappable), with the same columns. Defaults to 'tsv'.")
     parser.add_argument('--single_sentences', action='store_true', help='Process only single sentences. Defaults to False.')
     parser.add_argument('--chunk_size', type=int, default=1000000, help='Number of sentences per output chunk. Defaults to 1,000,000.')
+    parser.add_argument('--spacy_batch_size', type=int, default=256, help='Number of sentences spaCy processes per batch (nlp.pipe). Defaults to 256.')
+    parser.add_argument('--length_buckets', type=int, default=1, help='Pool this many spaCy batches and sort them by sentence length before tagging, so each batch holds sentences of similar length. Output order is unchanged. Defaults to 1 (no sorting).')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes for the spaCy filter. Defaults to 1 (no process pool).')
+    parser.add_argument('--fast_workers', type=int, default=1, help='Number of processes reading and fast-filtering newline-aligned byte ranges of the input. Defaults to 1.')
+    parser.add_argument('--fast_range_mb', type=int, default=8, help='Size in MB of the byte ranges handed to each fast filter worker. At most --fast_workers + 2 ranges are in flight, which bounds the memory their results take. Defaults to 8.')
+    parser.add_argument('--fast_engine', choices=['fused', 'chain', 'adaptive', 'columnar'], default='fused', help="How to run the fast filters: 'fused' checks each sentence in a single pass, 'chain' calls each filter function in turn, 'adaptive' reorders the chain by measured cost and rejection rate, 'columnar' runs vectorized Arrow kernels over batches of sentences (needs pyarrow and numpy). Defaults to 'fused'.")
+    parser.add_argument('--adaptive_sample_size', type=int, default=10000, help='Number of sentences sampled before the adaptive engine reorders the filters. Defaults to 10,000.')
+    parser.add_argument('--stats_exact', action='store_true', help='Never reorder the fast filters, so each rejection is attributed exactly as in past runs.')
+    parser.add_argument('--dedup', choices=['none', 'exact', 'near'], default='none', help="Drop repeated sentences before the spaCy filter: 'exact' drops identical sentences, 'near' also drops near-duplicates (MinHash/LSH). Defaults to 'none'.")
+    parser.add_argument('--cache_file', help='SQLite file caching spaCy PROPN decisions between runs. Created if missing.')
+    parser.add_argument('--propn_lexicon', metavar='FILE', help='SQLite file with a lexicon of word forms learned from spaCy results. Sentences whose words are all confidently not proper nouns are accepted without running spaCy. Created if missing.')
+    parser.add_argument('--lexicon_min_count', type=int, default=50, help='Number of times a word form must have been tagged by spaCy before the lexicon trusts it. Defaults to 50.')
+    parser.add_argument('--lexicon_max_propn_rate', type=float, default=0.0, help='Largest share of PROPN tags a trusted word form may have. Defaults to 0.0.')
+    parser.add_argument('--verify_propn_lexicon', action='store_true', help='Run spaCy on every sentence, and report how often the lexicon would have accepted a sentence spaCy rejects.')
+    parser.add_argument('--pipeline_threads', action='store_true', help='Run reading, fast filtering and the spaCy filter in separate threads connected by bounded queues, so they overlap with each other and with writing.')
+    parser.add_argument('--queue_size', type=int, default=8, help='Number of batches each --pipeline_threads queue holds before the stage feeding it blocks. Defaults to 8.')
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N', help=f'Process only shard i (0 to N-1) of the input, chosen by a hash of each sentence, so N machines can split one corpus without coordination. Combine the output folders with merge_shards.py. A completed shard run leaves {SHARD_FILENAME} in its output folder.')
+    parser.add_argument('--incremental', action='store_true', help=f'Process only input the earlier --incremental runs on this output folder have not seen: new files and data appended to uncompressed TSV files. Accepted sentences are added as further chunks, counts continue from the earlier runs, and with --dedup the duplicate filter remembers earlier sentences. The state is kept in {INCREMENTAL_FILENAME} in the output folder.')
+    parser.add_argument('--resume', action='store_true', help=f'Continue an interrupted run from the last completed chunk, using {CHECKPOINT_FILENAME} in the output folder.')
+    parser.add_argument('--profile', action='store_true', help=f'Measure wall time, CPU time, calls and lines/s per stage (and per fast filter with --fast_engine chain or adaptive), and write {PROFILE_FILENAME} to the output folder. Use --profile_memory to trace memory as well.')
+    parser.add_argument('--profile_memory', action='store_true', help='Like --profile, and also trace memory with tracemalloc (slows the run down several times).')
+    parser.add_argument('--profile_pstats', metavar='FILE', help='Also run the pipeline under cProfile and dump the pstats to FILE. The stats include the --pipeline_threads stage threads, but not the --workers and --fast_workers processes.')
+    parser.add_argument('--metrics_json', metavar='FILE', help='Write the filter counts, acceptance rate, chunk count and throughput (plus stage timings with --profile) of the run to FILE as JSON.')
+    parser.add_argument('--metrics_prom', metavar='FILE', help='Keep a Prometheus textfile (e.g. for the node exporter textfile collector) with the progress and throughput of the run updated in FILE.')
+    parser.add_argument('--metrics_interval', type=float, default=30, help='Seconds between updates of the --metrics_prom file. Defaults to 30.')
+    parser.add_argument('--fast_only', action='store_true', help='Run only the fast filters (and --dedup), without loading spaCy. Useful for quick checks of fast-filter pass rates.')
+    parser.add_argument('--minimal_pipeline', action='store_true', help='Load only the spaCy components needed for POS tags (no parser, NER or lemmatizer).')
+    parser.add_argument('--check_minimal_pipeline', nargs='?', const='output_preview', metavar='SAMPLE_FOLDER', help='Verify that the minimal pipeline makes the same PROPN decisions as the full pipeline on the TSV files in SAMPLE_FOLDER (default: output_preview), then exit.')
     args = parser.parse_args()
 
-    # Validate input file extension
-    if not args.input_file.lower().endswith('.tsv'):
-        print("Error: Input must be a .tsv file")
+    if args.check_minimal_pipeline:
+        if not os.path.isdir(args.check_minimal_pipeline):
+            print(f"Error: '{args.check_minimal_pipeline}' is not a directory.")
+            sys.exit(1)
+        try:
+            total, mismatches = check_minimal_pipeline(args.check_minimal_pipeline, args.spacy_batch_size)
+        except OSError:
+            print(f"Model '{SPACY_MODEL}' not found. Install with:")
+            print(f"python -m spacy download {SPACY_MODEL}")
+            sys.exit(1)
+        for sentence in mismatches:
+            print(f"Mismatch: {sentence}")
+        print(f"Checked {total} sentences: {len(mismatches)} decision(s) differ between the minimal and full pipeline.")
+        sys.exit(1 if mismatches else 0)
+
+    if not args.input_file or not args.output_folder:
+        parser.error("--input_file and --output_folder are required")
+
+    input_files = resolve_input_files(args.input_file)
+    if not input_files:
+        print(f"Error: no input files found in '{args.input_file}'.")
+        sys.exit(1)
+
+    # Validate input file extensions
+    for input_file in input_files:
+        if input_format(input_file) is None:
+            print(f"Error: Input must be a {', '.join(INPUT_FORMATS)} file, or a .tsv file compressed as "
+                  f"{', '.join('.tsv' + extension for extension in COMPRESSION_EXTENSIONS)}: '{input_file}'")
+            sys.exit(1)
+    table_input = input_format(input_files[0]) != 'tsv'
+    if any((input_format(input_file) != 'tsv') != table_input for input_file in input_files):
+        print("Error: input files must be all TSV or all Parquet/Arrow.")
+        sys.exit(1)
+    compressions = {input_compression(input_file) for input_file in input_files}
+
+    if 'zstd' in compressions or args.compress_output == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            print("Error: zstd compression requires zstandard. Install with: pip install zstandard")
+            sys.exit(1)
+
+    if args.compress_output is not None and args.output_format != 'tsv':
+        print("Error: --compress_output applies to TSV output only")
+        sys.exit(1)
+
+    if args.fast_workers > 1 and len(input_files) == 1 and compressions != {None}:
+        print("Error: --fast_workers needs uncompressed input or several input files, since a compressed file "
+              "cannot be split into ranges.")
+        sys.exit(1)
+
+    if table_input or args.output_format != 'tsv':
+        try:
+            import pyarrow.parquet
+            import numpy
+        except ImportError:
+            print("Error: Parquet and Arrow input and output require pyarrow and numpy. Install with: pip install pyarrow numpy")
+            sys.exit(1)
+
+    if table_input:
+        try:
+            # Every file must have the column found in the first one
+            for input_file in input_files:
+                if os.path.isfile(input_file):
+                    args.input_column = table_sentence_column(input_file, args.input_column)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+    if args.chunk_size < 1:
+        print("Error: --chunk_size must be at least 1")
+        sys.exit(1)
+
+    if args.spacy_batch_size < 1:
+        print("Error: --spacy_batch_size must be at least 1")
+        sys.exit(1)
+    if args.length_buckets < 1:
+        print("Error: --length_buckets must be at least 1")
+        sys.exit(1)
+    if args.queue_size < 1:
+        print("Error: --queue_size must be at least 1")
+        sys.exit(1)
+    if args.shard is not None and args.incremental:
+        print("Error: --incremental cannot be combined with --shard.")
+        sys.exit(1)
+    if args.shard is not None and args.dedup == 'near':
+        print("Error: --dedup near cannot be sharded, since near duplicates differ in text and may fall in different shards. Use --dedup exact, which is exact across shards.")
+        sys.exit(1)
+    if args.metrics_interval <= 0:
+        print("Error: --metrics_interval must be positive")
+        sys.exit(1)
+
+    if args.adaptive_sample_size < 1:
+        print("Error: --adaptive_sample_size must be at least 1")
+        sys.exit(1)
+
+    if args.fast_workers < 1 or args.fast_range_mb < 1:
+        print("Error: --fast_workers and --fast_range_mb must be at least 1")
+        sys.exit(1)
+
+    if args.workers < 1:
+        print("Error: --workers must be at least 1")
         sys.exit(1)
 
     # Validate output folder
@@ -110,121 +2491,422 @@ def main():
         print(f"Error: '{args.output_folder}' is not a directory. Create it or specify an existing directory.")
         sys.exit(1)
 
-    # Load Norwegian NLP model
-    try:
-        nlp = spacy.load("nb_core_news_sm")
-    except OSError:
-        print("Model 'nb_core_news_sm' not found. Install with:")
-        print("python -m spacy download nb_core_news_sm")
+    # With --incremental, only read the input earlier runs have not seen
+    incremental_state = None
+    file_ranges = None
+    if args.incremental:
+        incremental_state = load_incremental_state(args.output_folder)
+        if (incremental_state is not None
+                and any(incremental_state[option] != getattr(args, option) for option in INCREMENTAL_OPTIONS)):
+            print(f"Error: the incremental state in '{args.output_folder}' was written with different options.")
+            sys.exit(1)
+        try:
+            input_files, file_ranges, fingerprints, unchanged = plan_incremental_run(input_files, incremental_state)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Incremental run: {len(input_files)} new or grown file(s), {unchanged} unchanged file(s) skipped.")
+        if not input_files:
+            print("Nothing new to process.")
+            sys.exit(0)
+
+    # Reuse spaCy decisions from earlier runs of the same model
+    if args.fast_only and (args.cache_file or args.propn_lexicon or args.workers > 1 or args.minimal_pipeline):
+        print("Note: --cache_file, --propn_lexicon, --workers and --minimal_pipeline have no effect with --fast_only.")
+    if args.verify_propn_lexicon and not args.propn_lexicon:
+        print("Error: --verify_propn_lexicon needs --propn_lexicon.")
         sys.exit(1)
 
-    # Prepare the slow (spaCy) filter separately
-    spaCy_filter_func = create_proper_noun_filter(nlp)
+    propn_cache = None
+    if args.cache_file and not args.fast_only:
+        try:
+            propn_cache = PropnCache(args.cache_file, spacy_model_key(args.minimal_pipeline))
+        except sqlite3.Error as e:
+            print(f"Error: cannot open cache file '{args.cache_file}': {e}")
+            sys.exit(1)
+
+    # Skip spaCy for sentences made only of words it never tagged PROPN
+    propn_lexicon = None
+    if args.propn_lexicon and not args.fast_only:
+        try:
+            propn_lexicon = PropnLexicon(args.propn_lexicon, spacy_model_key(args.minimal_pipeline),
+                                         args.lexicon_min_count, args.lexicon_max_propn_rate,
+                                         verify=args.verify_propn_lexicon)
+        except sqlite3.Error as e:
+            print(f"Error: cannot open lexicon file '{args.propn_lexicon}': {e}")
+            sys.exit(1)
+
+    # Prepare the slow (spaCy) filter separately. With several workers each
+    # pool process loads its own copy of the model.
+    if args.fast_only:
+        spaCy_filter_func = None
+    elif args.workers > 1:
+        if not import_spacy().util.is_package(SPACY_MODEL):
+            print(f"Model '{SPACY_MODEL}' not found. Install with:")
+            print(f"python -m spacy download {SPACY_MODEL}")
+            sys.exit(1)
+        spaCy_filter_func = create_parallel_proper_noun_filter(args.workers, args.spacy_batch_size, args.minimal_pipeline,
+                                                               propn_cache, propn_lexicon, args.length_buckets,
+                                                               pool_context(args.pipeline_threads))
+    else:
+        # Load Norwegian NLP model
+        try:
+            nlp = load_spacy_model(args.minimal_pipeline)
+        except OSError:
+            print(f"Model '{SPACY_MODEL}' not found. Install with:")
+            print(f"python -m spacy download {SPACY_MODEL}")
+            sys.exit(1)
+        spaCy_filter_func = create_batched_proper_noun_filter(nlp, args.spacy_batch_size, propn_cache, propn_lexicon,
+                                                              args.length_buckets)
+
+    profiler = None
+    if args.profile or args.profile_memory:
+        profiler = PipelineProfiler(trace_memory=args.profile_memory)
 
     # Fast filters (applied before spaCy to reduce overhead)
-    fast_filters = [
-        (starts_with_capital, "starts_with_capital"),
-        (has_no_parentheses, "has_no_parentheses"),
-        (ends_with_punctuation, "ends_with_punctuation"),
-        (only_one_sentence, "only_one_sentence"),
-        (has_no_numbers, "has_no_numbers"),
-        (no_special_characters, "no_special_characters"),
-        (reading_time_filter, "reading_time_filter"),
-        (max_word_count_filter, "max_word_count_filter"),
-        (basic_proper_noun_filter, "basic_proper_noun_filter")
-    ]
+    fast_filters = FAST_FILTERS
+    if profiler is not None:
+        if args.fast_engine in ('fused', 'columnar'):
+            print(f"Note: per-filter timings need --fast_engine chain or adaptive; the {args.fast_engine} engine is timed as a whole.")
+        else:
+            fast_filters = [(profiler.function(filter_name, filter_func), filter_name)
+                            for filter_func, filter_name in fast_filters]
+    if args.fast_engine == 'adaptive' and args.stats_exact:
+        print("Note: --stats_exact keeps the fixed filter order; adaptive reordering is disabled.")
+        args.fast_engine = 'chain'
+    try:
+        first_failing_filter = create_fast_filter_engine(args.fast_engine, fast_filters, args.adaptive_sample_size)
+    except ImportError:
+        print("Error: --fast_engine columnar requires pyarrow and numpy. Install with: pip install pyarrow numpy")
+        sys.exit(1)
 
     # Track how many sentences each filter kills
     filter_fail_count = {}
     for _, filter_name in fast_filters:
         filter_fail_count[filter_name] = 0
-    filter_fail_count["proper_noun_filter"] = 0
+    if args.dedup != 'none':
+        filter_fail_count["duplicate_filter"] = 0
+    if spaCy_filter_func is not None:
+        filter_fail_count["proper_noun_filter"] = 0
 
-    survivors = []
-    total_lines = 0
+    deduplicator = None
+    if args.dedup == 'exact':
+        deduplicator = ExactDeduplicator()
+    elif args.dedup == 'near':
+        try:
+            deduplicator = NearDeduplicator()
+        except ImportError:
+            print("Error: --dedup near requires numpy. Install with: pip install numpy")
+            sys.exit(1)
 
-    # First pass: apply fast filters
-    with open(args.input_file, 'r', encoding='utf-8') as infile:
-        lines = infile.readlines()
+    # Per-file counts; offsets are positions within each file
+    file_stats = [{"input_file": input_file, "input_offset": 0, "final_lines": 0,
+                   "rejected": dict.fromkeys(filter_fail_count, 0)} for input_file in input_files]
 
-    for line in tqdm(lines, desc="Applying fast filters"):
-        line = line.strip()
-        if not line:
-            continue
+    # Continue from the last completed chunk of an interrupted run
+    input_offset = 0
+    chunk_count = 0
+    total_final = 0
+    previous_lines = 0
+    if incremental_state is not None:
+        if set(incremental_state["filter_fail_count"]) != set(filter_fail_count):
+            print(f"Error: the incremental state in '{args.output_folder}' was written with different options.")
+            sys.exit(1)
+        chunk_count = incremental_state["chunk_count"]
+        total_final = incremental_state["total_written"]
+        filter_fail_count.update(incremental_state["filter_fail_count"])
+        previous_lines = sum(filter_fail_count.values()) + total_final
+        for stats, (start, _) in zip(file_stats, file_ranges):
+            stats["input_offset"] = start
+            record = incremental_state["files"].get(os.path.abspath(stats["input_file"]))
+            if record is not None:
+                stats.update(final_lines=record["final_lines"], rejected=dict(record["rejected"]))
+        if deduplicator is not None:
+            load_incremental_hashes(args.output_folder, incremental_state, deduplicator)
+    if args.resume:
+        checkpoint = load_checkpoint(args.output_folder)
+        if checkpoint is None:
+            print(f"Error: --resume given but no {CHECKPOINT_FILENAME} found in '{args.output_folder}'.")
+            sys.exit(1)
+        if (checkpoint["input_file"] != os.path.abspath(args.input_file)
+                or checkpoint["chunk_size"] != args.chunk_size
+                or checkpoint["single_sentences"] != args.single_sentences
+                or checkpoint.get("output_format", "tsv") != args.output_format
+                or checkpoint.get("compress_output") != args.compress_output
+                or checkpoint.get("shard") != (list(args.shard) if args.shard else None)
+                or checkpoint.get("input_files", [os.path.abspath(args.input_file)])
+                != [os.path.abspath(input_file) for input_file in input_files]
+                or set(checkpoint["filter_fail_count"]) != set(filter_fail_count)):
+            print("Error: the checkpoint was written for a different input file or different options.")
+            sys.exit(1)
+        input_offset = checkpoint["input_offset"]
+        chunk_count = checkpoint["chunk_count"]
+        total_final = checkpoint["total_written"]
+        filter_fail_count.update(checkpoint["filter_fail_count"])
+        if "file_stats" in checkpoint:
+            for stats, saved in zip(file_stats, checkpoint["file_stats"]):
+                stats.update(saved, input_file=stats["input_file"])
+        else:
+            file_stats[0].update(input_offset=input_offset, final_lines=total_final,
+                                 rejected=dict(filter_fail_count))
+        file_index, file_position = split_file_offset(input_offset)
+        print(f"Resuming after chunk {chunk_count} at input {'row' if table_input else 'byte'} {file_position}"
+              + (f" of '{input_files[file_index]}'." if len(input_files) > 1 else "."))
 
-        parts = line.split('\t')
-        if len(parts) < 2:
-            continue
+        # The duplicate filter must remember every sentence before the resume
+        # point. Replaying the (cheap) fast filters over that part of the input
+        # rebuilds exactly the state it had.
+        if deduplicator is not None and input_offset > 0:
+            records = tqdm(read_fast_filtered(input_files, args.fast_engine, first_failing_filter,
+                                              end_offset=input_offset, input_column=args.input_column,
+                                              shard=args.shard, file_ranges=file_ranges),
+                           desc="Rebuilding duplicate filter", unit=" sentences")
+            for _ in apply_dedup(records, deduplicator, "duplicate_filter"):
+                pass
 
-        total_lines += 1
-        # We ignore the first column (ID) for final output,
-        # only use the second column (sentence).
-        sentence = parts[1].strip()
+    def write_checkpoint(writer):
+        if propn_lexicon is not None:
+            propn_lexicon.save()
+        save_checkpoint(args.output_folder, {
+            "input_file": os.path.abspath(args.input_file),
+            "input_files": [os.path.abspath(input_file) for input_file in input_files],
+            "input_offset": input_offset,
+            "chunk_count": writer.chunk_count,
+            "total_written": writer.total_written,
+            "chunk_size": args.chunk_size,
+            "single_sentences": args.single_sentences,
+            "output_format": args.output_format,
+            "compress_output": args.compress_output,
+            "shard": list(args.shard) if args.shard else None,
+            "filter_fail_count": filter_fail_count,
+            "file_stats": [{key: value for key, value in stats.items() if key != "input_file"} for stats in file_stats],
+        })
 
-        passed_all_fast = True
-        for filter_func, filter_name in fast_filters:
-            if not filter_func(sentence):
-                filter_fail_count[filter_name] += 1
-                passed_all_fast = False
-                break
+    # A shard file left by an earlier run no longer describes this folder
+    shard_path = os.path.join(args.output_folder, SHARD_FILENAME)
+    if os.path.exists(shard_path):
+        os.remove(shard_path)
+    # So does incremental state, unless this run continues it
+    if not args.incremental:
+        stale_state = load_incremental_state(args.output_folder)
+        if stale_state is not None:
+            remove_incremental_hashes(args.output_folder, stale_state)
+            os.remove(os.path.join(args.output_folder, INCREMENTAL_FILENAME))
 
-        if passed_all_fast:
-            survivors.append(sentence)
+    # With --pipeline_threads, reading, fast filtering and the spaCy filter
+    # each run in their own thread, and the main thread writes the output.
+    stage_queues = []
+    thread_profiles = [] if args.profile_pstats else None
+    pstats_profile = cProfile.Profile() if args.profile_pstats else None
 
-    # Second pass: apply the slow spaCy filter to survivors
-    final_pass = []
-    for sentence in tqdm(survivors, desc="Applying spaCy filter"):
-        if spaCy_filter_func(sentence):
-            final_pass.append(sentence)
-        else:
-            filter_fail_count["proper_noun_filter"] += 1
-
-    # Prepare metadata for final output lines
-    source = "https://www.nb.no/sprakbanken/ressurskatalog/oai-nb-no-sbr-80/"
-    additional_rationale = (
-        "This is a CC0 licensed corpus cleared from newspaper text. "
-        "The source sentences from a translation corpus is used.  "
-        "It is released by Språkbanken."
-    )
-    domain = "General"
+    def threaded(name, iterable, batch_size=256):
+        if not args.pipeline_threads:
+            return iterable
+        stage_queue = StageQueue(name, iterable, args.queue_size, batch_size, thread_profiles)
+        stage_queues.append(stage_queue)
+        return iter(stage_queue)
 
-    # Write the final survivors in 1000-line chunks
-    CHUNK_SIZE = args.chunk_size
-    total_final = len(final_pass)
-    chunk_count = 0
+    # Stream lines through the fast filters and then the spaCy filter as
+    # they are read, instead of loading the whole input first.
+    if args.fast_workers > 1 or args.fast_engine == 'columnar':
+        size, unit = input_files_size(input_files, file_ranges)
+        position = sum(stats["input_offset"] for stats in file_stats)
+        progress = tqdm(total=size - position if size is not None else None, desc="Filtering",
+                        unit=unit, unit_scale=True)
+    if args.fast_workers > 1:
+        # Read and fast-filter ranges of the input in a process pool
+        records = parallel_fast_filter_records(input_files, args.fast_workers, args.fast_engine,
+                                               input_offset, args.fast_range_mb << 20,
+                                               args.adaptive_sample_size, progress.update, args.input_column,
+                                               args.shard, file_ranges, pool_context(args.pipeline_threads))
+    elif args.fast_engine == 'columnar':
+        # Read and fast-filter whole blocks of lines with Arrow kernels
+        blocks = read_input_files(input_files, input_offset, input_column=args.input_column, columns=True,
+                                  progress=progress.update, shard=args.shard, file_ranges=file_ranges)
+        if profiler is not None:
+            blocks = profiler.stage("reading", blocks)
+            first_failing_filter = profiler.function("columnar_fast_filters", first_failing_filter, batched=True)
+        blocks = threaded("reading", blocks, batch_size=1)
+        records = apply_columnar_fast_filters(blocks, first_failing_filter)
+    else:
+        lines = tqdm(read_input_files(input_files, input_offset, input_column=args.input_column, shard=args.shard,
+                                      file_ranges=file_ranges),
+                     desc="Filtering", unit=" lines")
+        if profiler is not None:
+            lines = profiler.stage("reading", lines)
+            if args.fast_engine == 'fused':
+                first_failing_filter = profiler.function("fused_fast_filters", first_failing_filter)
+        lines = threaded("reading", lines)
+        records = apply_fast_filters(lines, first_failing_filter)
+    if profiler is not None:
+        records = profiler.stage("fast_filters", records)
+    records = threaded("fast_filters", records)
+    if deduplicator is not None:
+        records = apply_dedup(records, deduplicator, "duplicate_filter")
+        if profiler is not None:
+            records = profiler.stage("dedup", records)
+    if spaCy_filter_func is not None:
+        records = apply_batched_filter(records, spaCy_filter_func, "proper_noun_filter")
+        if profiler is not None:
+            records = profiler.stage("spacy", records)
+        records = threaded("spacy", records)
 
-    for i in range(0, total_final, CHUNK_SIZE):
-        chunk_count += 1
-        chunk = final_pass[i : i + CHUNK_SIZE]
-        chunk_filename = os.path.join(args.output_folder, f"output_{chunk_count}.tsv")
-        
-        if args.single_sentences:
-            with open(chunk_filename, 'w', encoding='utf-8') as outfile:
-                for sentence in chunk:
-                    outfile.write(
-                        f"{sentence}\n"
-                    )
+    if args.profile_pstats:
+        pstats_profile.enable()
 
-        else:
-            with open(chunk_filename, 'w', encoding='utf-8') as outfile:
-                for sentence in chunk:
-                    outfile.write(
-                        f"{sentence}\t"
-                        f"{source}\t"
-                        f"{additional_rationale}\t"
-                        f""  # Sentence Quality Assurance Feedback: blank
-                        f"\t"
-                        f"{domain}\n"
-                    )
+    # Write each accepted sentence as soon as it comes out of the pipeline.
+    # A checkpoint is saved after every completed chunk.
+    if args.output_format == 'tsv':
+        writer = ChunkWriter(args.output_folder, args.chunk_size, args.single_sentences,
+                             chunk_count=chunk_count, total_written=total_final, on_commit=write_checkpoint,
+                             compression=args.compress_output)
+    else:
+        writer = TableChunkWriter(args.output_folder, args.chunk_size, args.single_sentences, args.output_format,
+                                  chunk_count=chunk_count, total_written=total_final, on_commit=write_checkpoint)
+    def input_position():
+        return sum(stats["input_offset"] for stats in file_stats)
+
+    run_metrics = RunMetrics(args.input_file, filter_fail_count, input_position(), total_final,
+                             "rows" if table_input else "bytes")
+    next_metrics_update = time.monotonic() if args.metrics_prom else None
+    with writer:
+        write = writer.write
+        if profiler is not None:
+            write = profiler.function("writing", write)
+        for offset, sentence, tally in records:
+            file_index, position = split_file_offset(offset)
+            stats = file_stats[file_index]
+            if tally:
+                rejected = stats["rejected"]
+                for filter_name, count in tally.items():
+                    filter_fail_count[filter_name] += count
+                    rejected[filter_name] += count
+            input_offset = offset
+            stats["input_offset"] = position
+            if sentence is not None:
+                # Counted first, since write() may save a checkpoint
+                stats["final_lines"] += 1
+                write(sentence)
+            if next_metrics_update is not None and time.monotonic() >= next_metrics_update:
+                metrics = run_metrics.snapshot(input_position(), writer.total_written, writer.chunk_count)
+                replace_file(args.metrics_prom, format_prometheus_metrics(metrics))
+                next_metrics_update = time.monotonic() + args.metrics_interval
+    if pstats_profile is not None:
+        pstats_profile.disable()
+        # Stage threads have ended (the write loop drained them), so their
+        # profiles are complete
+        stats = pstats.Stats(pstats_profile)
+        for profile in thread_profiles:
+            stats.add(profile)
+        stats.dump_stats(args.profile_pstats)
+    if args.incremental:
+        # Record what this run has read, for the next one
+        state_files = dict(incremental_state["files"]) if incremental_state is not None else {}
+        for input_file, fingerprint, stats in zip(input_files, fingerprints, file_stats):
+            state_files[os.path.abspath(input_file)] = dict(fingerprint, final_lines=stats["final_lines"],
+                                                            rejected=stats["rejected"])
+        save_incremental_state(args.output_folder, {
+            **{option: getattr(args, option) for option in INCREMENTAL_OPTIONS},
+            "chunk_count": writer.chunk_count,
+            "total_written": writer.total_written,
+            "filter_fail_count": filter_fail_count,
+            "files": state_files,
+        }, deduplicator)
+    # The run is complete, so there is nothing left to resume
+    remove_checkpoint(args.output_folder)
+    if propn_cache is not None:
+        propn_cache.close()
+    if propn_lexicon is not None:
+        propn_lexicon.close()
+    total_final = writer.total_written
+    chunk_count = writer.chunk_count
+    total_lines = sum(filter_fail_count.values()) + total_final
+    metrics = run_metrics.snapshot(input_position(), total_final, chunk_count, finished=True)
+    for stats in file_stats:
+        stats["total_lines"] = sum(stats["rejected"].values()) + stats["final_lines"]
+    if args.shard is not None:
+        replace_file(shard_path, json.dumps({
+            "shard": args.shard[0],
+            "shards": args.shard[1],
+            "input_files": [os.path.abspath(input_file) for input_file in input_files],
+            "inputs": shard_inputs(input_files),
+            "chunk_size": args.chunk_size,
+            "single_sentences": args.single_sentences,
+            "output_format": args.output_format,
+            "compress_output": args.compress_output,
+            "dedup": args.dedup,
+            "chunk_count": chunk_count,
+            "total_written": total_final,
+            "filter_fail_count": filter_fail_count,
+            "file_stats": file_stats,
+        }, ensure_ascii=False, indent=2))
+    if args.metrics_prom:
+        replace_file(args.metrics_prom, format_prometheus_metrics(metrics))
 
     # Print statistics
     print("\n===== Filtering Statistics =====")
+    if args.shard is not None:
+        print(f"Shard {args.shard[0]}/{args.shard[1]}")
     print(f"Total lines processed: {total_lines}")
     for flt in filter_fail_count:
         print(f"Filtered out by {flt}: {filter_fail_count[flt]}")
     print(f"Final lines passed: {total_final}")
+    if incremental_state is not None:
+        print(f"New lines processed: {total_lines - previous_lines}, "
+              f"passed: {total_final - incremental_state['total_written']}")
+    if len(input_files) > 1:
+        print("Per input file (lines processed / passed):")
+        for stats in file_stats:
+            print(f"  {stats['input_file']}: {stats['total_lines']} / {stats['final_lines']}")
+    if propn_cache is not None:
+        print(f"spaCy cache hits: {propn_cache.hits}, misses: {propn_cache.misses}")
+    if propn_lexicon is not None and propn_lexicon.verify:
+        rate = propn_lexicon.disagreements / propn_lexicon.verified * 100 if propn_lexicon.verified else 0.0
+        print(f"PROPN lexicon verification: {propn_lexicon.verified} sentence(s) judged safe, "
+              f"{propn_lexicon.disagreements} of them rejected by spaCy ({rate:.3f}%)")
+        for sentence in propn_lexicon.disagreement_examples:
+            print(f"  {sentence}")
+    elif propn_lexicon is not None:
+        print(f"PROPN lexicon: {propn_lexicon.skipped} sentence(s) accepted without spaCy, "
+              f"{len(propn_lexicon.forms)} word forms known")
+    if stage_queues:
+        print(f"Pipeline queues (up to {args.queue_size} batches each):")
+        for stage_queue in stage_queues:
+            stats = stage_queue.stats()
+            print(f"  after {stage_queue.name}: mean depth {stats['mean_depth']:.1f}, max {stats['max_depth']}, "
+                  f"full {stats['full_percent']:.0f}% of puts, empty {stats['empty_percent']:.0f}% of gets")
+    if args.fast_engine == 'adaptive' and args.fast_workers == 1:
+        print(f"Adaptive fast filter order: {', '.join(first_failing_filter.filter_order)}")
     print(f"Output split into {chunk_count} file(s) under '{args.output_folder}'.")
 
+    report = None
+    if profiler is not None:
+        report = profiler.report(total_lines)
+        # The writer is timed per call, so it is reported as a stage
+        report["stages"]["writing"] = report["filters"].pop("writing")
+        if stage_queues:
+            report["queues"] = {stage_queue.name: stage_queue.stats() for stage_queue in stage_queues}
+    if args.metrics_json:
+        metrics["files"] = file_stats
+        if report is not None:
+            metrics["stages"] = report["stages"]
+            metrics["filters"] = report["filters"]
+        if stage_queues:
+            metrics["queues"] = {stage_queue.name: stage_queue.stats() for stage_queue in stage_queues}
+        replace_file(args.metrics_json, json.dumps(metrics, ensure_ascii=False, indent=2))
+        print(f"Metrics written to '{args.metrics_json}'.")
+
+    if report is not None:
+        print_profile_report(report)
+        profile_path = os.path.join(args.output_folder, PROFILE_FILENAME)
+        with open(profile_path, 'w', encoding='utf-8') as outfile:
+            json.dump(report, outfile, indent=2)
+        print(f"Profile written to '{profile_path}'.")
+    if args.profile_pstats:
+        print(f"cProfile stats written to '{args.profile_pstats}'.")
+        if args.workers > 1 or args.fast_workers > 1:
+            print("Note: the cProfile stats do not include the --workers and --fast_workers processes.")
+
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic Norwegian ID<TAB>sentence TSV corpora of any size.
+
+The word distribution is learned from the accepted sentences in
+single_sentences/ (first words, following words, sentence lengths and end
+punctuation), so clean generated lines look like real survivors. A
+controllable share of the lines gets one of the defects filter.py rejects:
+digits, parentheses, proper nouns (inside the sentence or as its first word),
+several sentences, special characters, a lowercase start, a missing end
+punctuation or too many words.
+
+    python generate_corpus.py --output source/synthetic.tsv --size 10MB
+    python generate_corpus.py --output /data/huge.tsv --size 100GB --digit_rate 0.2
+"""
+import argparse
+import bisect
+import glob
+import os
+import random
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCE_FOLDER = os.path.join(REPO_DIR, "single_sentences")
+
+# Names and places used for the proper noun defect
+PROPER_NOUNS = [
+    "Oslo", "Bergen", "Trondheim", "Stavanger", "Tromsø", "Kristiansand", "Norge", "Sverige",
+    "Stortinget", "Equinor", "Kari", "Ola", "Nordmann", "Solberg", "Støre", "Finnmark",
+]
+SPECIAL_TOKENS = ["«sitat»", "%", "&", "/", "\"", "*", "é", "+"]
+PARENTHESIZED = ["(NTB)", "(red.)", "(Ap)", "(H)", "(foto)", "(se under)"]
+
+SIZE_SUFFIXES = {"": 1, "B": 1, "KB": 10**3, "MB": 10**6, "GB": 10**9, "TB": 10**12}
+
+def parse_size(size: str) -> int:
+    """Parse a size such as '10MB' or '100GB' (decimal units) into bytes."""
+    text = size.strip().upper()
+    number = text.rstrip("KMGTB")
+    suffix = text[len(number):]
+    if suffix not in SIZE_SUFFIXES or not number:
+        raise ValueError(f"invalid size '{size}'")
+    return int(float(number) * SIZE_SUFFIXES[suffix])
+
+class WordModel:
+    """
+    Empirical distributions learned from accepted sentences: the first word,
+    the words that follow it, the sentence length and the end punctuation.
+    Each distribution is kept as the list of observed occurrences, so a
+    uniform pick from the list is a pick weighted by frequency.
+    """
+    def __init__(self, sentences):
+        self.first_words = []
+        self.other_words = []
+        self.lengths = []
+        self.endings = []
+        for sentence in sentences:
+            words = sentence[:-1].split()
+            if not words:
+                continue
+            self.endings.append(sentence[-1])
+            self.lengths.append(len(words))
+            self.first_words.append(words[0])
+            self.other_words.extend(words[1:])
+        if not self.first_words or not self.other_words:
+            raise ValueError("not enough sentences to learn a word distribution")
+
+    def sentence(self, rng: random.Random, num_words=None) -> str:
+        pick = rng.random
+        if num_words is None:
+            num_words = self.lengths[int(pick() * len(self.lengths))]
+        other_words = self.other_words
+        n = len(other_words)
+        words = [self.first_words[int(pick() * len(self.first_words))]]
+        words += [other_words[int(pick() * n)] for _ in range(num_words - 1)]
+        # Drop trailing commas etc. from the last word before the end punctuation
+        words[-1] = words[-1].rstrip(",:;")
+        return ' '.join(words) + self.endings[int(pick() * len(self.endings))]
+
+def load_sentences(folder: str):
+    """Return the first column of every TSV file in folder."""
+    sentences = []
+    for path in sorted(glob.glob(os.path.join(folder, "*.tsv"))):
+        with open(path, 'r', encoding='utf-8') as infile:
+            for line in infile:
+                sentence = line.split('\t')[0].strip()
+                if sentence:
+                    sentences.append(sentence)
+    return sentences
+
+################################################################
+# Defects
+################################################################
+
+def insert_word(sentence: str, word: str, rng: random.Random, first: int = 1) -> str:
+    words = sentence[:-1].split()
+    words.insert(rng.randint(min(first, len(words)), len(words)), word)
+    return ' '.join(words) + sentence[-1]
+
+def add_digits(sentence, model, rng):
+    return insert_word(sentence, str(rng.choice([rng.randint(1, 99), rng.randint(1900, 2030)])), rng, first=0)
+
+def add_parentheses(sentence, model, rng):
+    return insert_word(sentence, rng.choice(PARENTHESIZED), rng)
+
+def add_proper_noun(sentence, model, rng):
+    return insert_word(sentence, rng.choice(PROPER_NOUNS), rng)
+
+# A capitalized first word passes basic_proper_noun_filter, so only the
+# spaCy filter rejects these.
+def add_initial_proper_noun(sentence, model, rng):
+    return rng.choice(PROPER_NOUNS) + ' ' + sentence[0].lower() + sentence[1:]
+
+def add_second_sentence(sentence, model, rng):
+    return f"{sentence} {model.sentence(rng)}"
+
+def add_special_character(sentence, model, rng):
+    return insert_word(sentence, rng.choice(SPECIAL_TOKENS), rng)
+
+def lowercase_start(sentence, model, rng):
+    return sentence[0].lower() + sentence[1:]
+
+def drop_end_punctuation(sentence, model, rng):
+    return sentence[:-1] + rng.choice(["", "!", ":"])
+
+# With the default thresholds, reading_time_filter rejects these before
+# max_word_count_filter sees them (14 words take more than 7 seconds).
+def make_too_long(sentence, model, rng):
+    return model.sentence(rng, num_words=rng.randint(15, 30))
+
+# (argument name, default rate, defect function)
+DEFECTS = [
+    ("digit_rate", 0.10, add_digits),
+    ("parenthesis_rate", 0.05, add_parentheses),
+    ("proper_noun_rate", 0.15, add_proper_noun),
+    ("initial_proper_noun_rate", 0.05, add_initial_proper_noun),
+    ("multi_sentence_rate", 0.10, add_second_sentence),
+    ("special_character_rate", 0.05, add_special_character),
+    ("lowercase_rate", 0.03, lowercase_start),
+    ("missing_punctuation_rate", 0.03, drop_end_punctuation),
+    ("too_long_rate", 0.05, make_too_long),
+]
+
+def create_line_generator(model: WordModel, rates, seed: int = 0):
+    """
+    Return a function producing one synthetic sentence per call. rates maps
+    each defect argument name to the share of lines that get that defect;
+    the defects are mutually exclusive, so the rates must sum to at most 1.
+    """
+    rng = random.Random(seed)
+    functions = []
+    thresholds = []
+    total = 0.0
+    for name, _, defect in DEFECTS:
+        if rates[name] > 0:
+            total += rates[name]
+            functions.append(defect)
+            thresholds.append(total)
+    if total > 1:
+        raise ValueError("the defect rates must sum to at most 1")
+
+    def next_sentence() -> str:
+        sentence = model.sentence(rng)
+        i = bisect.bisect_right(thresholds, rng.random())
+        if i < len(functions):
+            sentence = functions[i](sentence, model, rng)
+        return sentence
+    return next_sentence
+
+def write_corpus(path: str, model: WordModel, rates, num_lines=None, num_bytes=None, seed: int = 0,
+                 progress=None):
+    """
+    Write ID<TAB>sentence lines to path until num_lines lines or num_bytes
+    bytes (whichever is given) have been written. Returns the line count.
+    """
+    next_sentence = create_line_generator(model, rates, seed)
+    written_lines = 0
+    written_bytes = 0
+    with open(path, 'w', encoding='utf-8', buffering=1 << 20) as outfile:
+        while True:
+            if num_lines is not None and written_lines >= num_lines:
+                break
+            if num_bytes is not None and written_bytes >= num_bytes:
+                break
+            line = f"{written_lines + 1}\t{next_sentence()}\n"
+            outfile.write(line)
+            written_lines += 1
+            written_bytes += len(line.encode('utf-8'))
+            if progress is not None and written_lines % 1000000 == 0:
+                progress(written_lines, written_bytes)
+    return written_lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Norwegian ID<TAB>sentence TSV corpus.")
+    parser.add_argument('--output', required=True, help='Output TSV file.')
+    size = parser.add_mutually_exclusive_group(required=True)
+    size.add_argument('--lines', type=int, help='Number of lines to generate.')
+    size.add_argument('--size', help='Approximate file size to generate, e.g. 10MB or 100GB.')
+    parser.add_argument('--source_folder', default=DEFAULT_SOURCE_FOLDER, help='Folder with accepted TSV sentences to learn the word distribution from. Defaults to single_sentences/.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed. Defaults to 0.')
+    for name, default, _ in DEFECTS:
+        parser.add_argument(f'--{name}', type=float, default=default, help=f'Share of lines with this defect. Defaults to {default}.')
+    args = parser.parse_args()
+
+    try:
+        num_bytes = parse_size(args.size) if args.size else None
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    sentences = load_sentences(args.source_folder)
+    if not sentences:
+        print(f"Error: no sentences found in '{args.source_folder}'.")
+        sys.exit(1)
+    model = WordModel(sentences)
+    rates = {name: getattr(args, name) for name, _, _ in DEFECTS}
+
+    def progress(lines, written):
+        print(f"{lines:,} lines, {written / 1e6:,.0f} MB", file=sys.stderr)
+
+    try:
+        lines = write_corpus(args.output, model, rates, args.lines, num_bytes, args.seed, progress)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f"Wrote {lines:,} lines to '{args.output}'.")
+
+if __name__ == '__main__':
+    main()
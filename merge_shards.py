@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Merge the output folders of sharded filter.py runs into one output folder.
+
+Each machine runs filter.py on the same input with --shard i/N and its own
+output folder. Once all N runs are complete, their folders are merged:
+
+    python merge_shards.py --shard_folders out_0 out_1 out_2 --output_folder output/
+
+The accepted sentences are re-chunked, shard by shard, into globally
+numbered output_1, output_2, ... chunks in the format the shards were
+written in, and the per-shard filter counts are added up. Since a sentence's
+shard is chosen by hashing its text, --dedup exact in the shard runs is
+exact across shards.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+
+import filter as cv_filter
+
+################################################################
+# Shards
+################################################################
+
+# Options that must be the same in every shard run. The input files are
+# compared by name, size and fingerprint ("inputs"), not by path, since
+# each machine may mount the corpus somewhere else.
+SHARD_OPTIONS = ["shards", "inputs", "single_sentences", "output_format", "compress_output", "dedup"]
+
+def load_shard(folder: str):
+    """Return the shard.json of a completed shard run in folder, or None."""
+    path = os.path.join(folder, cv_filter.SHARD_FILENAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding='utf-8') as infile:
+        return json.load(infile)
+
+def create_writer(output_folder: str, chunk_size: int, shard: dict):
+    """Return a ChunkWriter (or TableChunkWriter) for the output format of shard."""
+    if shard["output_format"] == 'tsv':
+        return cv_filter.ChunkWriter(output_folder, chunk_size, shard["single_sentences"],
+                                     compression=shard["compress_output"])
+    return cv_filter.TableChunkWriter(output_folder, chunk_size, shard["single_sentences"], shard["output_format"])
+
+def read_shard_sentences(folder: str, shard: dict):
+    """Yield the sentences of every output chunk of a shard run, in order."""
+    chunk_path = create_writer(folder, 1, shard).chunk_path
+    for chunk_number in range(1, shard["chunk_count"] + 1):
+        path = chunk_path(chunk_number)
+        if shard["output_format"] == 'tsv':
+            if shard["compress_output"] is None:
+                infile = open(path, encoding='utf-8', newline='\n')
+            else:
+                infile = io.TextIOWrapper(cv_filter.open_decompressed(path, shard["compress_output"]),
+                                          encoding='utf-8', newline='\n')
+            with infile:
+                for line in infile:
+                    line = line.rstrip('\n')
+                    yield line if shard["single_sentences"] else line.split('\t', 1)[0]
+        elif shard["output_format"] == 'parquet':
+            import pyarrow.parquet as pq
+            yield from pq.read_table(path, columns=["sentence"]).column("sentence").to_pylist()
+        else:
+            import pyarrow as pa
+            with pa.memory_map(path) as source:
+                yield from pa.ipc.open_file(source).read_all().column("sentence").to_pylist()
+
+def merge_counts(shards):
+    """Add up the filter counts and per-file counts of shards."""
+    filter_fail_count = dict.fromkeys(shards[0]["filter_fail_count"], 0)
+    file_stats = [{"input_file": stats["input_file"], "total_lines": 0, "final_lines": 0}
+                  for stats in shards[0]["file_stats"]]
+    for shard in shards:
+        for filter_name, count in shard["filter_fail_count"].items():
+            filter_fail_count[filter_name] += count
+        for merged, stats in zip(file_stats, shard["file_stats"]):
+            merged["total_lines"] += stats["total_lines"]
+            merged["final_lines"] += stats["final_lines"]
+    return filter_fail_count, file_stats
+
+################################################################
+# Main logic
+################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the output folders of filter.py --shard runs.")
+    parser.add_argument('--shard_folders', nargs='+', required=True, help='Output folders of the shard runs, one per shard.')
+    parser.add_argument('--output_folder', required=True, help='Existing folder to write the merged output chunks to.')
+    parser.add_argument('--chunk_size', type=int, help="Number of sentences per merged chunk. Defaults to the shard runs' chunk size.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.output_folder):
+        print(f"Error: '{args.output_folder}' is not a directory. Create it or specify an existing directory.")
+        sys.exit(1)
+    if any(name.startswith("output_") for name in os.listdir(args.output_folder)):
+        print(f"Error: '{args.output_folder}' already holds output chunks.")
+        sys.exit(1)
+
+    shards = {}
+    for folder in args.shard_folders:
+        shard = load_shard(folder)
+        if shard is None:
+            print(f"Error: no {cv_filter.SHARD_FILENAME} in '{folder}'. Is its shard run complete?")
+            sys.exit(1)
+        if shard["shard"] in shards:
+            print(f"Error: shard {shard['shard']} is given twice ('{shards[shard['shard']][0]}' and '{folder}').")
+            sys.exit(1)
+        shards[shard["shard"]] = (folder, shard)
+
+    first = next(iter(shards.values()))[1]
+    for folder, shard in shards.values():
+        if (any(shard[option] != first[option] for option in SHARD_OPTIONS)
+                or set(shard["filter_fail_count"]) != set(first["filter_fail_count"])):
+            print(f"Error: '{folder}' was written for a different input or different options.")
+            sys.exit(1)
+    missing = sorted(set(range(first["shards"])) - set(shards))
+    if missing:
+        print(f"Error: shard(s) {', '.join(map(str, missing))} of {first['shards']} missing.")
+        sys.exit(1)
+
+    chunk_size = args.chunk_size or first["chunk_size"]
+    if chunk_size < 1:
+        print("Error: --chunk_size must be at least 1")
+        sys.exit(1)
+
+    # Re-chunk the shards' sentences in shard order
+    ordered = [shards[index] for index in range(first["shards"])]
+    with create_writer(args.output_folder, chunk_size, first) as writer:
+        for folder, shard in ordered:
+            for sentence in cv_filter.tqdm(read_shard_sentences(folder, shard), desc=f"Shard {shard['shard']}",
+                                           unit=" sentences"):
+                writer.write(sentence)
+
+    filter_fail_count, file_stats = merge_counts([shard for _, shard in ordered])
+    total_final = writer.total_written
+    total_lines = sum(filter_fail_count.values()) + total_final
+
+    # Print statistics
+    print("\n===== Filtering Statistics =====")
+    print(f"Merged {first['shards']} shard(s)")
+    print(f"Total lines processed: {total_lines}")
+    for flt in filter_fail_count:
+        print(f"Filtered out by {flt}: {filter_fail_count[flt]}")
+    print(f"Final lines passed: {total_final}")
+    if len(file_stats) > 1:
+        print("Per input file (lines processed / passed):")
+        for stats in file_stats:
+            print(f"  {stats['input_file']}: {stats['total_lines']} / {stats['final_lines']}")
+    print(f"Output split into {writer.chunk_count} file(s) under '{args.output_folder}'.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Tests that the fused and columnar fast filter engines, and the columnar
+reader, agree with the reference FAST_FILTERS chain and read_sentences,
+and that an interrupted run resumes to the same output.
+
+    python -m pytest test_filter.py
+"""
+import os
+import random
+import sys
+
+import pytest
+
+import filter as cv_filter
+
+# Characters that Python's str methods classify in less obvious ways:
+# whitespace that is not ' ' (NBSP, the \x1c-\x1f separators, NEL, the
+# ideographic space), uppercase letters outside ASCII (including 'İ', whose
+# lowercase is two code points, and the titlecase 'ǅ'), letter-like numbers
+# ('Ⅻ' is uppercase but not a digit) and digits outside ASCII.
+TRICKY_CHARACTERS = ['\xa0', '\x1c', '\x1d', '\x1f', '\x85', ' ', '　', '\t', '\x0b', '\x0c',
+                     'İ', 'ǅ', 'Ⅻ', 'ⅻ', 'Æ', 'Ø', 'Å', 'æ', 'ø', 'å', 'É', 'é', 'ß',
+                     '²', '٣', '０', '7', '½', '(', ')', '.', '?', '!', ',', '-', '«', '»', '%']
+
+BASE_SENTENCES = [
+    "Dette er en helt vanlig setning.",
+    "Hvor mange ganger har du vært her?",
+    "Han gikk hjem etter en lang dag på jobben.",
+    "Det var en uvanlig kald morgen i byen.",
+    "Ja.",
+    "Dette er en setning med veldig mange ord som aldri ser ut til å ta slutt.",
+    "Arbeidsmarkedsdepartementet og kommunaldepartementet samarbeider tett.",
+]
+
+def edge_cases():
+    """Base sentences with each tricky character at the start, the middle and the end."""
+    cases = ["", " ", ".", "A.", "A ?", "\xa0Hei på deg.", "Hei\xa0på deg.", "Hei på deg.\x85",
+             "Ⅻ er et tall.", "İstanbul er stor.", "Det er ²to.", "Det er ٣ ting.", "Hei\x1cpå deg.",
+             "Det er ĺ fint.", "Hun bor i İzmir nå.", "Dette er\x1cEn test.", "Dette er\xa0En test."]
+    for sentence in BASE_SENTENCES:
+        cases.append(sentence)
+        middle = len(sentence) // 2
+        for char in TRICKY_CHARACTERS:
+            cases.append(char + sentence)
+            cases.append(sentence[:middle] + char + sentence[middle:])
+            cases.append(sentence[:middle + 1] + char + sentence[middle + 1:])
+            cases.append(sentence[:-1] + char)
+            cases.append(sentence + char)
+    return cases
+
+def random_cases(count=3000, seed=1):
+    """Base sentences with a few random words replaced by tricky characters."""
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        words = rng.choice(BASE_SENTENCES).split(' ')
+        for _ in range(rng.randint(1, 3)):
+            i = rng.randrange(len(words))
+            words[i] = rng.choice([rng.choice(TRICKY_CHARACTERS), words[i] + rng.choice(TRICKY_CHARACTERS),
+                                   words[i].capitalize()])
+        cases.append(rng.choice([' ', '\xa0', '\x1c']).join(words))
+    return cases
+
+CASES = edge_cases() + random_cases()
+
+def reference_results(cases):
+    chain = cv_filter.create_fast_filter_chain(cv_filter.FAST_FILTERS)
+    return [chain(sentence) for sentence in cases]
+
+def test_fused_matches_chain():
+    assert [cv_filter.fused_fast_filters(sentence) for sentence in CASES] == reference_results(CASES)
+
+def test_columnar_matches_chain():
+    pa = pytest.importorskip("pyarrow")
+    pytest.importorskip("numpy")
+    filter_names = [None] + [filter_name for _, filter_name in cv_filter.FAST_FILTERS]
+    codes = cv_filter.create_columnar_fast_filters()(pa.array(CASES, type=pa.string()))
+    assert [filter_names[code] for code in codes.tolist()] == reference_results(CASES)
+
+def test_read_sentence_columns_matches_read_sentences(tmp_path):
+    pytest.importorskip("pyarrow")
+    pytest.importorskip("numpy")
+    lines = [f"{i}\t{sentence}\n" for i, sentence in enumerate(CASES[:400])]
+    lines += ["no columns\n", "\n", "  \t  \n", "1\t\xa0Padded sentence.\xa0\t extra\n",
+              "2\tLone\rcarriage return.\n", "3\tWindows line end.\r\n", "4\t\x1cSeparator.\x1c\n",
+              "5\tLast line without newline."]
+    path = tmp_path / "input.tsv"
+    path.write_bytes(''.join(lines).encode('utf-8'))
+    expected = list(cv_filter.read_sentences(str(path)))
+    # Small blocks so block boundaries fall all over the file
+    for block_size in (64, 1000, 1 << 20):
+        columns = [(offset, sentence)
+                   for offsets, sentences in cv_filter.read_sentence_columns(str(path), block_size=block_size)
+                   for offset, sentence in zip(offsets.tolist(), sentences.to_pylist())]
+        assert columns == expected
+
+    # Reading a range that starts at a line start stops at the same place
+    start, end = expected[10][0], expected[200][0]
+    columns = [(offset, sentence)
+               for offsets, sentences in cv_filter.read_sentence_columns(str(path), start, end, block_size=512)
+               for offset, sentence in zip(offsets.tolist(), sentences.to_pylist())]
+    assert columns == list(cv_filter.read_sentences(str(path), start, end))
+
+def test_table_input_skips_sentences_with_tabs_and_line_breaks(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    pytest.importorskip("numpy")
+    sentences = ["Dette er en fin dag.", "Dette er en\nfin dag i dag.", "Det var\tgod stemning der.",
+                 "Det var\r\nen god dag.", None, " Det var en god dag.\n", "Han kom\rhjem sent."]
+    path = tmp_path / "input.parquet"
+    pq.write_table(pa.table({"id": list(range(len(sentences))), "sentence": sentences}), str(path))
+    expected = [(1, "Dette er en fin dag."), (6, "Det var en god dag.")]
+    assert list(cv_filter.read_input(str(path))) == expected
+    columns = [(offset, sentence)
+               for offsets, block in cv_filter.read_input_columns(str(path))
+               for offset, sentence in zip(offsets.tolist(), block.to_pylist())]
+    assert columns == expected
+
+class Interrupted(Exception):
+    pass
+
+def run_filter(monkeypatch, args, interrupt_after=None):
+    """Run filter.py's main() with args, raising Interrupted after interrupt_after checkpoints."""
+    monkeypatch.setattr(sys, 'argv', ['filter.py', '--fast_only'] + args)
+    if interrupt_after is not None:
+        save_checkpoint = cv_filter.save_checkpoint
+        saved = []
+
+        def interrupting_save_checkpoint(output_folder, checkpoint):
+            save_checkpoint(output_folder, checkpoint)
+            saved.append(checkpoint)
+            if len(saved) == interrupt_after:
+                raise Interrupted()
+        monkeypatch.setattr(cv_filter, 'save_checkpoint', interrupting_save_checkpoint)
+    cv_filter.main()
+    monkeypatch.undo()
+
+def output_lines(folder):
+    chunks = sorted((name for name in os.listdir(folder) if name.startswith("output_")),
+                    key=lambda name: int(name.split('_')[1].split('.')[0]))
+    lines = []
+    for name in chunks:
+        with open(os.path.join(folder, name), encoding='utf-8') as infile:
+            lines += infile.read().splitlines()
+    return lines
+
+@pytest.mark.parametrize("interrupt_after", [1, 2, 3])
+def test_resume_matches_uninterrupted_run(tmp_path, monkeypatch, capsys, interrupt_after):
+    # Lines separated by a lone '\r' must each get their own resume offset
+    text = ("1\tDette er en fin dag.\r2\tDet var en god dag.\n3\tHan kom hjem i går.\r\n"
+            "4\tvi ble hjemme.\r5\tHun leste en bok.\r6\tDe gikk en tur.\n7\tDet regnet hele natten.")
+    input_file = tmp_path / "input.tsv"
+    input_file.write_bytes(text.encode('utf-8'))
+    full = tmp_path / "full"
+    resumed = tmp_path / "resumed"
+    full.mkdir()
+    resumed.mkdir()
+    args = ['--input_file', str(input_file), '--chunk_size', '1', '--single_sentences']
+
+    run_filter(monkeypatch, args + ['--output_folder', str(full)])
+    full_stats = capsys.readouterr().out.split("===== Filtering Statistics =====")[1]
+    with pytest.raises(Interrupted):
+        run_filter(monkeypatch, args + ['--output_folder', str(resumed)], interrupt_after)
+    run_filter(monkeypatch, args + ['--output_folder', str(resumed), '--resume'])
+    resumed_stats = capsys.readouterr().out.split("===== Filtering Statistics =====")[1]
+
+    assert output_lines(full) == ["Dette er en fin dag.", "Det var en god dag.", "Han kom hjem i går.",
+                                  "Hun leste en bok.", "De gikk en tur.", "Det regnet hele natten."]
+    assert output_lines(resumed) == output_lines(full)
+    assert resumed_stats.splitlines()[:-1] == full_stats.splitlines()[:-1]
+
+def test_incremental_run_leaves_unfinished_last_line(tmp_path, monkeypatch):
+    input_file = tmp_path / "input.tsv"
+    output = tmp_path / "output"
+    output.mkdir()
+    args = ['--input_file', str(input_file), '--output_folder', str(output), '--single_sentences',
+            '--incremental']
+    # The last line is still being written, cut inside its ID column
+    input_file.write_bytes("1\tDette er en fin dag.\n1".encode('utf-8'))
+    files, file_ranges, _, _ = cv_filter.plan_incremental_run([str(input_file)], None)
+    assert file_ranges == [(0, len("1\tDette er en fin dag.\n"))]
+    run_filter(monkeypatch, args)
+    assert output_lines(output) == ["Dette er en fin dag."]
+
+    with open(input_file, 'ab') as outfile:
+        outfile.write("2\tDet var en god dag.\n".encode('utf-8'))
+    run_filter(monkeypatch, args)
+    assert output_lines(output) == ["Dette er en fin dag.", "Det var en god dag."]